@@ -0,0 +1,91 @@
+from sqlalchemy import select, insert
+from models import db, User, Achievement, UserAchievement, event_participants
+
+# Тип умови -> вираз над таблицею user, з яким порівнюється condition_value.
+# Новий condition_type додається одним рядком, без окремих запитів.
+CONDITIONS = {
+    'events_count': User.events_count,
+    'waste_collected': User.total_waste,
+    'area_cleaned': User.total_area,
+}
+
+# Засіюється в migrations.py одним INSERT ... ON CONFLICT (name) DO NOTHING
+CATALOG = [
+    {'name': 'Перші кроки', 'description': 'Участь у першій толоці', 'icon': '🌱',
+     'condition_type': 'events_count', 'condition_value': 1},
+    {'name': 'Активіст', 'description': 'Участь у 5 толоках', 'icon': '🌿',
+     'condition_type': 'events_count', 'condition_value': 5},
+    {'name': 'Герой чистоти', 'description': 'Участь у 20 толоках', 'icon': '🌳',
+     'condition_type': 'events_count', 'condition_value': 20},
+    {'name': 'Збирач', 'description': 'Зібрано 10 кг сміття', 'icon': '♻️',
+     'condition_type': 'waste_collected', 'condition_value': 10},
+    {'name': 'Еко-воїн', 'description': 'Зібрано 100 кг сміття', 'icon': '🏆',
+     'condition_type': 'waste_collected', 'condition_value': 100},
+    {'name': 'Очищувач', 'description': 'Очищено 100 м²', 'icon': '✨',
+     'condition_type': 'area_cleaned', 'condition_value': 100},
+]
+
+_catalog = None
+
+
+def register_condition(condition_type, expression):
+    CONDITIONS[condition_type] = expression
+
+
+def get_catalog():
+    global _catalog
+    if _catalog is None:
+        rows = db.session.execute(
+            select(Achievement.id, Achievement.name, Achievement.condition_type, Achievement.condition_value)
+            .order_by(Achievement.id)
+        ).all()
+        _catalog = [tuple(row) for row in rows]
+    return _catalog
+
+
+def invalidate_catalog():
+    global _catalog
+    _catalog = None
+
+
+def _evaluate(user_filter):
+    catalog = [a for a in get_catalog() if a[2] in CONDITIONS]
+    if not catalog:
+        return {}
+
+    condition_types = sorted({a[2] for a in catalog})
+    columns = [CONDITIONS[t].label(t) for t in condition_types]
+    users = db.session.execute(select(User.id, User.username, *columns).where(user_filter)).all()
+    if not users:
+        return {}
+
+    existing = set(db.session.execute(
+        select(UserAchievement.user_id, UserAchievement.achievement_id)
+        .join(User, User.id == UserAchievement.user_id)
+        .where(user_filter)
+    ).all())
+
+    new_rows = []
+    granted = {}
+    for row in users:
+        values = row._mapping
+        for achievement_id, name, condition_type, condition_value in catalog:
+            if (row.id, achievement_id) in existing:
+                continue
+            value = values[condition_type]
+            if value is not None and value >= condition_value:
+                new_rows.append({'user_id': row.id, 'achievement_id': achievement_id})
+                granted.setdefault(row.username, []).append(name)
+
+    if new_rows:
+        db.session.execute(insert(UserAchievement), new_rows)
+    return granted
+
+
+def grant_for_event(event_id):
+    participant_ids = select(event_participants.c.user_id).where(event_participants.c.event_id == event_id)
+    return _evaluate(User.id.in_(participant_ids))
+
+
+def grant_for_users(user_ids):
+    return _evaluate(User.id.in_(list(user_ids)))
@@ -1,10 +1,38 @@
+import hmac
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+import tempfile
+import time
+import click
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort, send_from_directory, \
+    stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.utils import secure_filename
-from datetime import datetime
-from models import db, User, Event, Team, Achievement, UserAchievement, PollutedPlace
-from PIL import Image
+from datetime import datetime, date, timedelta
+from sqlalchemy import select, create_engine
+from sqlalchemy.orm import joinedload
+from models import db, User, Event, Team, UserAchievement, PollutedPlace, event_participants
+from rewards import settle_event
+from stats import get_stats, bump_stats, reconcile_stats, stats_dict, stats_etag
+from leaderboard import users_board, teams_board, decode_cursor
+import querycount
+import metrics
+import fragcache
+import auth
+import migrations
+import nearby
+import rollups
+import exports
+import jobs
+import mailer
+import tasks
+import live
+import geo
+import spatial
+import images
+import storage
+import registration
+import reports
+import ratelimit
+import ical
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'toloka-secret-key-change-in-production')
@@ -15,12 +43,68 @@ if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres://'):
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['STATS_MAX_AGE'] = int(os.environ.get('STATS_MAX_AGE', 30))
+app.config['QUERY_BUDGET'] = int(os.environ.get('QUERY_BUDGET', 0)) or None
+app.config['MAP_CLUSTER_MAX_ZOOM'] = 14
+app.config['MAP_MAX_FEATURES'] = 2000
+app.config['MAP_MAX_AGE'] = 60
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local')
+app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET')
+app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')
+app.config['S3_PUBLIC_URL'] = os.environ.get('S3_PUBLIC_URL')
+app.config['RATELIMIT_STORAGE'] = os.environ.get('RATELIMIT_STORAGE', 'memory')
+app.config['REPORTS_RATE_CAPACITY'] = 500
+app.config['REPORTS_RATE_PER_SECOND'] = 1.0
+app.config['REPORTS_MAX_BATCH'] = 5000
+app.config['REPORTS_CHUNK_SIZE'] = 500
+app.config['REPORTS_DEDUPE_RADIUS_M'] = 50
+app.config['REPORTS_DEDUPE_WINDOW'] = timedelta(hours=24)
+app.config['CALENDAR_MAX_DAYS'] = 62
+app.config['CALENDAR_TIMEZONE'] = 'Europe/Kyiv'
+app.config['ICAL_MAX_AGE'] = 300
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', os.path.join(app.instance_path, 'metrics'))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 500))
+app.config['FRAGMENT_CACHE'] = os.environ.get('FRAGMENT_CACHE', 'memory')
+app.config['FRAGMENT_CACHE_TTL'] = int(os.environ.get('FRAGMENT_CACHE_TTL', 60))
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_WORKERS'] = int(os.environ.get('PASSWORD_WORKERS', 2))
+app.config['SESSION_USER_TTL'] = 30
+app.config['NEARBY_MAX_RADIUS_M'] = 50000
+app.config['NEARBY_MAX_LIMIT'] = 100
+app.config['EVENT_PARTICIPANTS_SHOWN'] = 100
+app.config['NEARBY_MAX_AGE'] = 30
+app.config['ROLLUP_MAX_POINTS'] = 400
+app.config['EXPORT_TOKEN'] = os.environ.get('EXPORT_TOKEN')
+app.config['EXPORT_CHUNK_SIZE'] = 1000
+app.config['JOB_CONCURRENCY'] = int(os.environ.get('JOB_CONCURRENCY', 4))
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'localhost')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 1025))
+app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
+app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', '').lower() in ('1', 'true', 'yes')
+app.config['BASE_URL'] = os.environ.get('BASE_URL', 'http://localhost:5000')
+app.config['LIVE_ENABLED'] = os.environ.get('LIVE_ENABLED', '').lower() in ('1', 'true', 'yes')
+app.config['LIVE_URL'] = os.environ.get('LIVE_URL')
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 db.init_app(app)
+querycount.init_app(app)
+metrics.init_app(app)
+fragcache.init_app(app)
+storage.init_app(app)
+images.init_app(app)
+ratelimit.init_app(app)
+auth.init_app(app)
+jobs.init_app(app)
+mailer.init_app(app)
+tasks.init_app(app)
+live.init_app(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -29,67 +113,34 @@ login_manager.login_message = 'Будь ласка, увійдіть для до
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return auth.load_session_user(user_id)
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def optimize_image(image_path, max_size=(800, 800)):
-    try:
-        with Image.open(image_path) as img:
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            img.save(image_path, optimize=True, quality=85)
-    except Exception as e:
-        print(f"Error optimizing image: {e}")
-
-
-def check_achievements(user):
-    achievements_to_grant = []
-    all_achievements = Achievement.query.all()
-
-    for achievement in all_achievements:
-        already_has = UserAchievement.query.filter_by(
-            user_id=user.id, achievement_id=achievement.id
-        ).first()
-
-        if already_has:
-            continue
-
-        should_grant = False
-        if achievement.condition_type == 'events_count' and user.events_count >= achievement.condition_value:
-            should_grant = True
-        elif achievement.condition_type == 'waste_collected' and user.total_waste >= achievement.condition_value:
-            should_grant = True
-        elif achievement.condition_type == 'area_cleaned' and user.total_area >= achievement.condition_value:
-            should_grant = True
-
-        if should_grant:
-            ua = UserAchievement(user_id=user.id, achievement_id=achievement.id)
-            db.session.add(ua)
-            achievements_to_grant.append(achievement.name)
-
-    if achievements_to_grant:
-        db.session.commit()
-    return achievements_to_grant
+def save_upload(field):
+    file = request.files.get(field)
+    if file and file.filename and allowed_file(file.filename):
+        ext = file.filename.rsplit('.', 1)[1].lower()
+        return storage.store(file.stream, ext)
+    return None
 
 
 @app.route('/')
 def index():
-    upcoming_events = Event.query.filter(
-        Event.date >= datetime.utcnow(),
-        Event.status == 'planned'
-    ).order_by(Event.date).limit(6).all()
+    # Запити виконуються лише тоді, коли фрагмента немає в кеші
+    def load_events():
+        return Event.query.filter(
+            Event.date >= datetime.utcnow(),
+            Event.status == 'planned'
+        ).order_by(Event.date).limit(6).all()
 
-    stats = {
-        'total_events': Event.query.filter_by(status='completed').count(),
-        'total_waste': db.session.query(db.func.sum(Event.waste_collected)).scalar() or 0,
-        'total_area': db.session.query(db.func.sum(Event.area_cleaned)).scalar() or 0,
-        'total_users': User.query.count()
-    }
+    def load_stats():
+        return stats_dict(get_stats())
 
-    return render_template('index.html', events=upcoming_events, stats=stats)
+    return render_template('index.html', load_events=load_events, load_stats=load_stats)
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -115,9 +166,15 @@ def register():
             flash('Email вже зареєстрований', 'danger')
             return redirect(url_for('register'))
 
-        user = User(username=username, email=email, full_name=full_name)
-        user.set_password(password)
+        try:
+            password_hash = auth.hash_password(password)
+        except auth.PasswordBusy:
+            flash('Сервер зайнятий, спробуйте ще раз за кілька секунд', 'warning')
+            return render_template('register.html'), 503, {'Retry-After': '2'}
+
+        user = User(username=username, email=email, full_name=full_name, password_hash=password_hash)
         db.session.add(user)
+        bump_stats(total_users=1)
         db.session.commit()
 
         flash('Реєстрація успішна! Тепер увійдіть в систему.', 'success')
@@ -135,8 +192,12 @@ def login():
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '')
 
-        user = User.query.filter_by(username=username).first()
-        if user and user.check_password(password):
+        try:
+            user = auth.authenticate(username, password)
+        except auth.PasswordBusy:
+            flash('Сервер зайнятий, спробуйте ще раз за кілька секунд', 'warning')
+            return render_template('login.html'), 503, {'Retry-After': '2'}
+        if user:
             login_user(user)
             flash('Успішний вхід!', 'success')
             next_page = request.args.get('next')
@@ -190,31 +251,57 @@ def create_event():
             creator_id=current_user.id
         )
 
-        if 'image_before' in request.files:
-            file = request.files['image_before']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"{int(datetime.utcnow().timestamp())}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                optimize_image(filepath)
-                event.image_before = filename
+        event.image_before = save_upload('image_before')
+        if event.image_before:
+            event.image_before_status = 'pending'
 
         db.session.add(event)
         db.session.commit()
 
+        if event.image_before:
+            images.submit(event.id, 'image_before', event.image_before)
+
         flash('Подію успішно створено!', 'success')
         return redirect(url_for('event_detail', event_id=event.id))
 
     return render_template('event_create.html')
 
 
+@app.route('/media/<path:key>')
+def media(key):
+    backend = storage.backend()
+    if backend.local_path(key) is not None:
+        response = send_from_directory(backend.root, key, max_age=storage.IMMUTABLE_MAX_AGE)
+    elif backend.exists(key):
+        response = app.response_class(backend.open(key).iter_chunks(storage.CHUNK_SIZE),
+                                      mimetype=storage.content_type(key))
+        response.cache_control.max_age = storage.IMMUTABLE_MAX_AGE
+    else:
+        abort(404)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/events/<int:event_id>')
 def event_detail(event_id):
-    event = Event.query.get_or_404(event_id)
+    event = Event.query.options(joinedload(Event.creator)).filter_by(id=event_id).first_or_404()
+    # Лише перші учасники й лише потрібні колонки; решту показує лічильник participants_count
+    participants = db.session.execute(
+        select(User.id, User.username)
+        .join(event_participants, event_participants.c.user_id == User.id)
+        .where(event_participants.c.event_id == event_id)
+        .order_by(event_participants.c.joined_at, event_participants.c.user_id)
+        .limit(app.config['EVENT_PARTICIPANTS_SHOWN'])
+    ).all()
     is_participant = False
+    waitlist_position = None
     if current_user.is_authenticated:
-        is_participant = current_user in event.participants
-    return render_template('event_detail.html', event=event, is_participant=is_participant)
+        is_participant = registration.is_participant(event.id, current_user.id)
+        if not is_participant and event.max_participants:
+            waitlist_position = registration.waitlist_position(event.id, current_user.id)
+    return render_template('event_detail.html', event=event, participants=participants,
+                           is_participant=is_participant, waitlist_position=waitlist_position)
 
 
 @app.route('/events/<int:event_id>/join', methods=['POST'])
@@ -222,14 +309,19 @@ def event_detail(event_id):
 def join_event(event_id):
     event = Event.query.get_or_404(event_id)
 
-    if current_user in event.participants:
+    result = registration.join(event.id, current_user.id)
+    db.session.commit()
+
+    if result == registration.JOINED:
+        flash('Ви успішно зареєструвались на подію!', 'success')
+    elif result == registration.ALREADY_JOINED:
         flash('Ви вже зареєстровані на цю подію', 'info')
-    elif event.max_participants and len(event.participants) >= event.max_participants:
-        flash('Вибачте, місця закінчились', 'warning')
+    elif result == registration.WAITLISTED:
+        flash('Місця закінчились — вас додано до списку очікування', 'warning')
+    elif result == registration.ALREADY_WAITLISTED:
+        flash('Ви вже у списку очікування', 'info')
     else:
-        event.participants.append(current_user)
-        db.session.commit()
-        flash('Ви успішно зареєструвались на подію!', 'success')
+        flash('Реєстрацію на цю подію закрито', 'warning')
 
     return redirect(url_for('event_detail', event_id=event_id))
 
@@ -239,16 +331,19 @@ def join_event(event_id):
 def leave_event(event_id):
     event = Event.query.get_or_404(event_id)
 
-    if current_user in event.participants:
-        event.participants.remove(current_user)
-        db.session.commit()
+    left, promoted = registration.leave(event.id, current_user.id)
+    db.session.commit()
+    if left:
         flash('Ви відмінили реєстрацію', 'info')
+    if promoted:
+        flash('Місце передано наступному з черги', 'info')
 
     return redirect(url_for('event_detail', event_id=event_id))
 
 
 @app.route('/events/<int:event_id>/complete', methods=['POST'])
 @login_required
+@querycount.query_budget(20)
 def complete_event(event_id):
     event = Event.query.get_or_404(event_id)
 
@@ -259,103 +354,291 @@ def complete_event(event_id):
     waste = request.form.get('waste_collected', 0, type=float)
     area = request.form.get('area_cleaned', 0, type=float)
 
-    event.waste_collected = waste
-    event.area_cleaned = area
-    event.status = 'completed'
-
-    if 'image_after' in request.files:
-        file = request.files['image_after']
-        if file and file.filename and allowed_file(file.filename):
-            filename = secure_filename(f"{int(datetime.utcnow().timestamp())}_{file.filename}")
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            optimize_image(filepath)
-            event.image_after = filename
-
-    points_per_person = int(waste * 10 + area * 2)
-    participant_count = len(event.participants)
-
-    if participant_count > 0:
-        for participant in event.participants:
-            participant.points += points_per_person
-            participant.events_count += 1
-            participant.total_waste += waste / participant_count
-            participant.total_area += area / participant_count
-
-            new_achievements = check_achievements(participant)
-            if new_achievements:
-                flash(f'{participant.username} отримав досягнення: {", ".join(new_achievements)}', 'success')
-
+    participants = settle_event(event.id, waste, area)
+    if participants is None:
+        db.session.rollback()
+        flash('Подію вже завершено', 'info')
+        return redirect(url_for('event_detail', event_id=event_id))
+    bump_stats(total_events=1, total_waste=waste, total_area=area)
+    rollups.record(event.id, waste, area, participants)
+
+    image_after = save_upload('image_after')
+    if image_after:
+        # Попередній файл втрачає посилання; storage-gc видалить його, коли лічильник стане нульовим
+        storage.release(event.image_after)
+        event.image_after = image_after
+        event.image_after_status = 'pending'
+
+    # Досягнення перевіряє воркер черги; завдання комітиться разом із завершенням події
+    jobs.enqueue('grant_achievements', {'event_id': event.id})
     db.session.commit()
-    flash('Подію завершено! Бали нараховано учасникам.', 'success')
+
+    if image_after:
+        images.submit(event.id, 'image_after', image_after)
+
+    flash('Подію завершено! Бали нараховано учасникам, досягнення зʼявляться за хвилину.', 'success')
     return redirect(url_for('event_detail', event_id=event_id))
 
 
 @app.route('/calendar')
 def calendar():
-    events = Event.query.filter(
-        Event.date >= datetime.utcnow(),
-        Event.status == 'planned'
-    ).order_by(Event.date).all()
+    return render_template('calendar.html')
 
-    events_json = [{
-        'id': e.id,
-        'title': e.title,
-        'start': e.date.isoformat(),
-        'url': url_for('event_detail', event_id=e.id),
-        'location': e.location
-    } for e in events]
 
-    return render_template('calendar.html', events_json=events_json)
+def parse_window():
+    try:
+        start = datetime.fromisoformat(request.args['start'])
+        end = datetime.fromisoformat(request.args['end'])
+    except (KeyError, ValueError):
+        return None
+    if not start < end <= start + timedelta(days=app.config['CALENDAR_MAX_DAYS']):
+        return None
+    return start, end
+
+
+@app.route('/api/calendar')
+def api_calendar():
+    window = parse_window()
+    if window is None:
+        return jsonify({'error': f'Параметри start і end (ISO), не більше {app.config["CALENDAR_MAX_DAYS"]} днів'}), 400
+    start, end = window
+
+    # Вікно читається діапазоном індексу (status, date)
+    rows = db.session.execute(
+        select(Event.id, Event.title, Event.date, Event.location, Event.participants_count, Event.max_participants)
+        .where(Event.status == 'planned', Event.date >= start, Event.date < end)
+        .order_by(Event.date)
+    ).all()
+    events = [{
+        'id': row.id,
+        'title': row.title,
+        'start': row.date.isoformat(),
+        'url': url_for('event_detail', event_id=row.id),
+        'location': row.location,
+        'participants': row.participants_count,
+        'max_participants': row.max_participants,
+    } for row in rows]
+
+    response = jsonify(events)
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response.make_conditional(request)
+
+
+def ical_response(kind, value, name):
+    conditions = ical.feed_filter(kind, value)
+    etag, last_modified = ical.validators(conditions, f'{kind}:{value}')
+    # Тіло генерується лише під час читання, тож на 304 календар не будується зовсім
+    body = ical.generate(conditions, name, app.config['CALENDAR_TIMEZONE'],
+                         lambda event_id: url_for('event_detail', event_id=event_id, _external=True),
+                         request.host)
+    response = app.response_class(stream_with_context(body), mimetype='text/calendar')
+    response.headers['Content-Disposition'] = f'inline; filename="{kind}.ics"'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['ICAL_MAX_AGE']
+    return response.make_conditional(request)
+
+
+@app.route('/calendar/users/<username>.ics')
+def user_calendar_feed(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    return ical_response('user', user.id, f'Толоки {user.username}')
+
+
+@app.route('/calendar/teams/<int:team_id>.ics')
+def team_calendar_feed(team_id):
+    team = Team.query.get_or_404(team_id)
+    return ical_response('team', team.id, f'Толоки команди {team.name}')
+
+
+@app.route('/calendar/cities/<city>.ics')
+def city_calendar_feed(city):
+    return ical_response('city', city, f'Толоки: {city}')
 
 
 @app.route('/map')
 def map_view():
-    polluted_places = PollutedPlace.query.filter_by(status='reported').all()
-    events = Event.query.filter_by(status='planned').all()
-
-    return render_template('map.html', polluted_places=polluted_places, events=events)
+    places_count = PollutedPlace.query.filter_by(status='reported').count()
+    events_count = Event.query.filter_by(status='planned').count()
+
+    return render_template('map.html', places_count=places_count, events_count=events_count)
+
+
+@app.route('/api/map')
+def api_map():
+    bbox = geo.parse_bbox(request.args.get('bbox'))
+    if bbox is None:
+        return jsonify({'error': 'Параметр bbox: захід,південь,схід,північ'}), 400
+    zoom = request.args.get('zoom', 0, type=int)
+    layers = [layer for layer in request.args.get('layers', 'places,events').split(',') if layer in spatial.LAYERS]
+
+    collection = spatial.feature_collection(bbox, zoom, layers,
+                                            cluster_max_zoom=app.config['MAP_CLUSTER_MAX_ZOOM'],
+                                            limit=app.config['MAP_MAX_FEATURES'])
+    response = jsonify(collection)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['MAP_MAX_AGE']
+    return response
+
+
+@app.route('/api/nearby')
+def api_nearby():
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    radius = request.args.get('radius', 5000, type=float)
+    match = request.args.get('match', 0, type=float)
+    max_radius = app.config['NEARBY_MAX_RADIUS_M']
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180) \
+            or not 0 < radius <= max_radius or not 0 <= match <= max_radius:
+        return jsonify({'error': f'Параметри lat, lon і radius (до {max_radius} м), необовʼязково match (м)'}), 400
+    layers = [layer for layer in request.args.get('layers', 'places,events').split(',') if layer in ('places', 'events')]
+    limit = max(1, min(request.args.get('limit', 20, type=int), app.config['NEARBY_MAX_LIMIT']))
+
+    response = jsonify(nearby.search(lat, lon, radius, layers, limit=limit, match_radius_m=match or None))
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['NEARBY_MAX_AGE']
+    return response
 
 
 @app.route('/map/report', methods=['POST'])
 @login_required
 def report_pollution():
-    data = request.get_json()
-
-    place = PollutedPlace(
-        title=data.get('title'),
-        description=data.get('description'),
-        latitude=data.get('latitude'),
-        longitude=data.get('longitude'),
-        severity=data.get('severity', 'medium'),
-        reporter_id=current_user.id
-    )
-
-    db.session.add(place)
+    data = request.get_json(silent=True) if request.is_json else request.form.to_dict()
+    row, errors = reports.validate(data)
+    if errors:
+        return jsonify({'success': False, 'errors': errors}), 400
+
+    granted, retry_after = take_report_tokens(1)
+    if not granted:
+        return jsonify({'success': False, 'errors': ['Забагато звітів, спробуйте пізніше']}), 429, \
+            {'Retry-After': str(retry_after)}
+
+    (place_id, duplicate_of), = ingest_reports([row])
+    if place_id is not None:
+        photo = save_upload('photo')
+        if photo:
+            place = db.session.get(PollutedPlace, place_id)
+            storage.release(place.photo)
+            place.photo = photo
     db.session.commit()
 
-    return jsonify({'success': True, 'id': place.id})
+    if duplicate_of is not None:
+        return jsonify({'success': True, 'id': duplicate_of, 'duplicate': True})
+    return jsonify({'success': True, 'id': place_id})
+
+
+def take_report_tokens(count):
+    return ratelimit.take('reports', current_user.id, count,
+                          app.config['REPORTS_RATE_CAPACITY'], app.config['REPORTS_RATE_PER_SECOND'])
+
+
+def ingest_reports(rows):
+    return reports.ingest_chunk(rows, current_user.id,
+                                radius_m=app.config['REPORTS_DEDUPE_RADIUS_M'],
+                                window=app.config['REPORTS_DEDUPE_WINDOW'])
+
+
+def bulk_report_items():
+    limit = app.config['REPORTS_MAX_BATCH']
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return reports.parse_ndjson(request.stream, limit)
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        return [(None, 'invalid_json')]
+    items = [(item, None) for item in data[:limit]]
+    if len(data) > limit:
+        items.append((None, 'too_many'))
+    return items
+
+
+@app.route('/api/reports/bulk', methods=['POST'])
+@login_required
+@querycount.query_budget(100)
+def bulk_report_pollution():
+    results = []
+    pending = []
+    retry_after = 0
+
+    def flush():
+        nonlocal retry_after
+        if not pending:
+            return
+        granted, wait = take_report_tokens(len(pending))
+        accepted, limited = pending[:granted], pending[granted:]
+        outcomes = ingest_reports([row for _, row, _ in accepted])
+        db.session.commit()
+        for (index, _, client_id), (place_id, duplicate_of) in zip(accepted, outcomes):
+            if duplicate_of is not None:
+                results.append({'index': index, 'client_id': client_id, 'status': 'duplicate', 'id': duplicate_of})
+            else:
+                results.append({'index': index, 'client_id': client_id, 'status': 'created', 'id': place_id})
+        for index, _, client_id in limited:
+            results.append({'index': index, 'client_id': client_id, 'status': 'rate_limited'})
+        retry_after = max(retry_after, wait)
+        pending.clear()
+
+    for index, (item, parse_error) in enumerate(bulk_report_items()):
+        client_id = item.get('client_id') if isinstance(item, dict) else None
+        if parse_error:
+            results.append({'index': index, 'client_id': client_id, 'status': 'invalid', 'errors': [parse_error]})
+            continue
+        row, errors = reports.validate(item)
+        if errors:
+            results.append({'index': index, 'client_id': client_id, 'status': 'invalid', 'errors': errors})
+            continue
+        pending.append((index, row, client_id))
+        if len(pending) >= app.config['REPORTS_CHUNK_SIZE']:
+            flush()
+    flush()
+
+    results.sort(key=lambda result: result['index'])
+    summary = {status: sum(1 for r in results if r['status'] == status)
+               for status in ('created', 'duplicate', 'invalid', 'rate_limited')}
+    response = jsonify({'results': results, **summary})
+    if summary['rate_limited']:
+        response.headers['Retry-After'] = str(retry_after)
+        if not summary['created'] and not summary['duplicate']:
+            response.status_code = 429
+    return response
 
 
 @app.route('/profile/<username>')
 def profile(username):
     user = User.query.filter_by(username=username).first_or_404()
-    achievements = UserAchievement.query.filter_by(user_id=user.id).all()
-    participated = user.participated_events[-10:]
 
-    return render_template('profile.html', user=user, achievements=achievements, events=participated)
+    def load_activity():
+        achievements = UserAchievement.query.filter_by(user_id=user.id).all()
+        participated = Event.query.join(event_participants, event_participants.c.event_id == Event.id) \
+            .filter(event_participants.c.user_id == user.id) \
+            .order_by(event_participants.c.joined_at.desc()).limit(10).all()
+        return achievements, participated, users_board.rank(user.points)
+
+    return render_template('profile.html', user=user, load_activity=load_activity)
+
+
+def board_page(board):
+    after = decode_cursor(request.args.get('after'))
+    if after is None:
+        rows, next_cursor = board.top()
+        return rows, next_cursor, 0
+    rows, next_cursor = board.page(after)
+    return rows, next_cursor, board.position(*after) + 1
 
 
 @app.route('/leaderboard')
 def leaderboard():
-    top_users = User.query.order_by(User.points.desc()).limit(50).all()
-    return render_template('leaderboard.html', users=top_users)
+    my_rank = users_board.rank(current_user.points) if current_user.is_authenticated else None
+    return render_template('leaderboard.html', load_page=lambda: board_page(users_board), my_rank=my_rank)
 
 
 @app.route('/teams')
 def teams():
-    all_teams = Team.query.order_by(Team.points.desc()).all()
-    return render_template('teams.html', teams=all_teams)
+    return render_template('teams.html', load_page=lambda: board_page(teams_board))
 
 
 @app.route('/teams/create', methods=['POST'])
@@ -374,7 +657,9 @@ def create_team():
 
     team = Team(name=name, description=description, captain_id=current_user.id)
     db.session.add(team)
-    team.members.append(current_user)
+    # current_user — легка проєкція, а для колекції потрібен справжній обʼєкт User
+    team.members.append(db.session.get(User, current_user.id))
+    bump_stats(active_teams=1)
     db.session.commit()
 
     flash('Команду створено!', 'success')
@@ -383,47 +668,373 @@ def create_team():
 
 @app.route('/api/stats')
 def api_stats():
-    stats = {
-        'total_events': Event.query.filter_by(status='completed').count(),
-        'total_waste': float(db.session.query(db.func.sum(Event.waste_collected)).scalar() or 0),
-        'total_area': float(db.session.query(db.func.sum(Event.area_cleaned)).scalar() or 0),
-        'total_users': User.query.count(),
-        'active_teams': Team.query.count()
-    }
-    return jsonify(stats)
-
-
-def init_achievements():
-    achievements_data = [
-        {'name': 'Перші кроки', 'description': 'Участь у першій толоці', 'icon': '🌱', 'type': 'events_count',
-         'value': 1},
-        {'name': 'Активіст', 'description': 'Участь у 5 толоках', 'icon': '🌿', 'type': 'events_count', 'value': 5},
-        {'name': 'Герой чистоти', 'description': 'Участь у 20 толоках', 'icon': '🌳', 'type': 'events_count',
-         'value': 20},
-        {'name': 'Збирач', 'description': 'Зібрано 10 кг сміття', 'icon': '♻️', 'type': 'waste_collected', 'value': 10},
-        {'name': 'Еко-воїн', 'description': 'Зібрано 100 кг сміття', 'icon': '🏆', 'type': 'waste_collected',
-         'value': 100},
-        {'name': 'Очищувач', 'description': 'Очищено 100 м²', 'icon': '✨', 'type': 'area_cleaned', 'value': 100},
-    ]
-
-    for ach_data in achievements_data:
-        if not Achievement.query.filter_by(name=ach_data['name']).first():
-            achievement = Achievement(
-                name=ach_data['name'],
-                description=ach_data['description'],
-                icon=ach_data['icon'],
-                condition_type=ach_data['type'],
-                condition_value=ach_data['value']
-            )
-            db.session.add(achievement)
-
-    db.session.commit()
+    row = get_stats()
+    response = jsonify(stats_dict(row))
+    response.set_etag(stats_etag(row))
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['STATS_MAX_AGE']
+    return response.make_conditional(request)
+
+
+def parse_day(name, default):
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+@app.route('/api/stats/timeseries')
+def api_stats_timeseries():
+    period = request.args.get('period', 'month')
+    scope = request.args.get('scope', 'all')
+    key = request.args.get('key', '') if scope != 'all' else ''
+    end = parse_day('end', date.today() + timedelta(days=1))
+    default_days = {'day': 30, 'week': 7 * 12, 'month': 365}.get(period, 365)
+    start = parse_day('start', end - timedelta(days=default_days) if end else None)
+    if period not in rollups.PERIODS or scope not in rollups.SCOPES or (scope != 'all' and not key) \
+            or start is None or end is None or not start < end \
+            or rollups.bucket_count(period, start, end) > app.config['ROLLUP_MAX_POINTS']:
+        return jsonify({'error': f'period: {"/".join(rollups.PERIODS)}, scope: {"/".join(rollups.SCOPES)} '
+                                 f'(team і cell потребують key), start < end у форматі YYYY-MM-DD, '
+                                 f'не більше {app.config["ROLLUP_MAX_POINTS"]} точок'}), 400
+
+    response = jsonify({'period': period, 'scope': scope, 'key': key,
+                        'points': rollups.series(period, scope, key, start, end)})
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['STATS_MAX_AGE']
+    return response
+
+
+@app.route('/api/stats/breakdown')
+def api_stats_breakdown():
+    period = request.args.get('period', 'month')
+    scope = request.args.get('scope', 'team')
+    order = request.args.get('order', 'waste')
+    day = parse_day('date', date.today())
+    if period not in rollups.PERIODS or scope not in ('team', 'cell') or order not in rollups.MEASURES \
+            or day is None:
+        return jsonify({'error': f'period: {"/".join(rollups.PERIODS)}, scope: team/cell, '
+                                 f'order: {"/".join(rollups.MEASURES)}, date у форматі YYYY-MM-DD'}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+
+    items = rollups.breakdown(period, scope, day, limit=limit, order=order)
+    if scope == 'team' and items:
+        names = dict(db.session.execute(
+            select(Team.id, Team.name).where(Team.id.in_([int(item['key']) for item in items]))
+        ).all())
+        for item in items:
+            item['name'] = names.get(int(item['key']))
+    response = jsonify({'period': period, 'scope': scope,
+                        'start': rollups.period_start(period, day).isoformat(), 'items': items})
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['STATS_MAX_AGE']
+    return response
+
+
+# SSE обслуговує окремий процес з gevent (див. Procfile, live); у звичайних воркерах маршрути вимкнені
+@app.route('/live/stats')
+def live_stats():
+    return live.response(['stats']) or abort(404)
+
+
+@app.route('/live/events/<int:event_id>')
+def live_event(event_id):
+    return live.response([f'event:{event_id}']) or abort(404)
+
+
+@app.route('/api/export/<dataset>.<fmt>')
+def api_export(dataset, fmt):
+    token = app.config['EXPORT_TOKEN']
+    # Без EXPORT_TOKEN експорт вимкнено: повні вивантаження не мають бути публічними за замовчуванням
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    if dataset not in exports.DATASETS or fmt not in exports.FORMATS \
+            or (fmt == 'geojson' and not exports.has_geometry(dataset)):
+        abort(404)
+    try:
+        since = exports.parse_since(request.args['updated_since']) if request.args.get('updated_since') else None
+        after = exports.parse_after(dataset, request.args['after']) if request.args.get('after') else None
+    except ValueError:
+        return jsonify({'error': 'updated_since: дата ISO 8601, after: ключ останнього отриманого рядка'}), 400
+
+    # Наступний інкрементальний експорт починається з моменту старту цього
+    started = datetime.utcnow()
+    compress = request.accept_encodings['gzip'] > 0
+    body = exports.stream(dataset, fmt, updated_since=since, after=after,
+                          chunk=app.config['EXPORT_CHUNK_SIZE'], compress=compress)
+    response = app.response_class(stream_with_context(body), mimetype=exports.FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{dataset}.{fmt}"'
+    response.headers['X-Export-Started'] = started.isoformat()
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_store = True
+    return response
+
+
+@app.cli.group('db')
+def db_group():
+    pass
+
+
+@db_group.command('upgrade')
+def db_upgrade_command():
+    applied = migrations.upgrade(db.engine, echo=click.echo)
+    click.echo(f'Застосовано міграцій: {len(applied)}')
+
+
+@db_group.command('status')
+def db_status_command():
+    applied = migrations.applied_versions(db.engine)
+    for version, name, _ in sorted(migrations.MIGRATIONS):
+        click.echo(f'{"✓" if version in applied else " "} {version:04d} {name}')
+
+
+@db_group.command('check')
+@click.option('--url', default=None, help='Порожня база того ж типу; для SQLite за замовчуванням тимчасова')
+def db_check_command(url):
+    # Перевіряє шлях оновлення бази, створеної початковою версією застосунку, до поточних моделей
+    if url is None and db.engine.dialect.name != 'sqlite':
+        raise click.UsageError('Для цієї бази потрібна --url порожньої бази того ж типу')
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(url or f'sqlite:///{os.path.join(directory, "check.db")}')
+        try:
+            problems = migrations.check_upgrade(engine, echo=click.echo)
+        finally:
+            engine.dispose()
+    for problem in problems:
+        click.echo(f'✗ {problem}')
+    if problems:
+        raise SystemExit(1)
+    click.echo('Оновлення з початкової схеми проходить')
+
+
+@app.cli.command('rebuild-rollups')
+@click.option('--chunk', type=int, default=5000)
+def rebuild_rollups_command(chunk):
+    # Перерахунок в одній транзакції: читачі бачать старі підсумки до комміту
+    with db.engine.begin() as conn:
+        processed = rollups.rebuild(conn, chunk=chunk, echo=click.echo)
+    click.echo(f'Перераховано подій: {processed}')
+
+
+@app.cli.command('export')
+@click.argument('dataset', type=click.Choice(exports.DATASETS))
+@click.option('--format', 'fmt', type=click.Choice(tuple(exports.FORMATS)), default='csv')
+@click.option('--output', '-o', default='-', help='Файл; розширення .gz вмикає стиснення')
+@click.option('--updated-since', help='Лише рядки, змінені після цього часу (ISO 8601)')
+@click.option('--after', help='Ключ останнього експортованого рядка для продовження')
+@click.option('--chunk', type=int, default=1000)
+def export_command(dataset, fmt, output, updated_since, after, chunk):
+    if fmt == 'geojson' and not exports.has_geometry(dataset):
+        raise click.BadParameter(f'{dataset} не має координат', param_hint='--format')
+    try:
+        since = exports.parse_since(updated_since) if updated_since else None
+        after = exports.parse_after(dataset, after) if after else None
+    except ValueError:
+        raise click.BadParameter('updated-since: дата ISO 8601, after: ключ рядка')
+
+    started = datetime.utcnow()
+    # Ключ після кожної записаної пачки: з ним перерваний експорт продовжується через --after
+    progress = lambda count, key: click.echo(f'{count} рядків, --after {key}', err=True)
+    body = exports.stream(dataset, fmt, updated_since=since, after=after, chunk=chunk,
+                          compress=output.endswith('.gz'), on_chunk=progress)
+    with click.open_file(output, 'wb') as f:
+        for data in body:
+            f.write(data)
+            f.flush()
+    click.echo(f'Наступний інкрементальний експорт: --updated-since {started.isoformat()}', err=True)
+
+
+@app.cli.group('jobs')
+def jobs_group():
+    pass
+
+
+@jobs_group.command('work')
+@click.option('--concurrency', type=int, default=None)
+@click.option('--once', is_flag=True, help='Виконати готові завдання і вийти')
+def jobs_work_command(concurrency, once):
+    jobs.work(concurrency=concurrency, once=once, echo=click.echo)
+
+
+@jobs_group.command('status')
+def jobs_status_command():
+    for kind, status, count in jobs.counts():
+        click.echo(f'{kind:20} {status:8} {count}')
+
+
+@app.cli.command('mail-sink')
+@click.option('--host', default='localhost')
+@click.option('--port', type=int, default=1025)
+@click.option('--directory', default=None, help='Каталог для .eml (типово instance/mail)')
+def mail_sink_command(host, port, directory):
+    directory = directory or os.path.join(app.instance_path, 'mail')
+    click.echo(f'SMTP на {host}:{port}, листи в {directory}')
+    mailer.sink(host, port, directory).serve_forever()
+
+
+@app.cli.command('reconcile-stats')
+@click.option('--every', type=int, default=0, help='Повторювати кожні N секунд')
+def reconcile_stats_command(every):
+    while True:
+        row = reconcile_stats()
+        click.echo(f'stats v{row.version}: {stats_dict(row)}')
+        if not every:
+            break
+        time.sleep(every)
+
+
+@app.cli.command('backfill-geohash')
+@click.option('--chunk', type=int, default=1000)
+def backfill_geohash_command(chunk):
+    # Той самий крок, що й у міграціях: пише в таблицю напряму, тож updated_at рядків не змінюється
+    for table_name in ('event', 'polluted_place'):
+        with db.engine.begin() as conn:
+            updated = migrations.backfill_geohash(conn, table_name, chunk)
+        click.echo(f'{table_name}: {updated}')
+
+
+@app.cli.command('reprocess-images')
+@click.option('--failed', is_flag=True, help='Також повторити невдалі')
+def reprocess_images_command(failed):
+    statuses = ['pending', 'failed'] if failed else ['pending']
+    app.config['IMAGE_WORKERS'] = 0
+    for field in images.IMAGE_FIELDS:
+        status_column = getattr(Event, f'{field}_status')
+        rows = db.session.execute(select(Event.id, getattr(Event, field)).where(status_column.in_(statuses))).all()
+        for event_id, filename in rows:
+            images.submit(event_id, field, filename)
+        click.echo(f'{field}: {len(rows)}')
+
+
+@app.cli.command('storage-gc')
+@click.option('--grace-hours', type=int, default=1)
+def storage_gc_command(grace_hours):
+    removed = storage.collect_garbage(images.variant_keys, grace=timedelta(hours=grace_hours))
+    click.echo(f'Видалено обʼєктів: {removed}')
+
+
+@app.cli.command('registration-stress')
+@click.option('--users', type=int, default=200)
+@click.option('--capacity', type=int, default=20)
+@click.option('--threads', type=int, default=16)
+@click.option('--database-url', default=None, help='Окрема база для навантаження; за замовчуванням тимчасова SQLite')
+def registration_stress_command(users, capacity, threads, database_url):
+    if database_url == app.config['SQLALCHEMY_DATABASE_URI']:
+        raise click.UsageError('Навантажувальна перевірка не запускається на робочій базі застосунку')
+    with tempfile.TemporaryDirectory() as directory:
+        summary, problems = registration.stress_test(
+            database_url or f'sqlite:///{os.path.join(directory, "stress.db")}',
+            users=users, capacity=capacity, threads=threads)
+    click.echo(summary)
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        raise SystemExit(1)
+
+
+@app.cli.command('check-query-budget')
+@click.option('--budget', type=int, default=None, help='Бюджет запитів на сторінку')
+@click.option('--as-user', 'username', default=None, help='Перевірити також від імені користувача')
+def check_query_budget_command(budget, username):
+    if budget:
+        app.config['QUERY_BUDGET'] = budget
+    if not app.config['QUERY_BUDGET']:
+        raise click.UsageError('Задайте QUERY_BUDGET або --budget')
+
+    with app.test_request_context():
+        paths = [url_for(endpoint) for endpoint in ('index', 'leaderboard', 'teams', 'calendar', 'map_view', 'api_stats')]
+        paths += [url_for('event_detail', event_id=e.id) for e in Event.query.order_by(Event.id.desc()).limit(5)]
+        paths += [url_for('profile', username=u.username) for u in User.query.order_by(User.points.desc()).limit(5)]
+
+    user_ids = [None]
+    if username:
+        user_ids.append(User.query.filter_by(username=username).first_or_404().id)
+
+    failures = []
+    for user_id in user_ids:
+        failures += querycount.crawl(app, paths, user_id=user_id)
+    for failure in failures:
+        click.echo(failure, err=True)
+    if failures:
+        raise SystemExit(1)
+    click.echo(f'{len(paths) * len(user_ids)} сторінок в межах бюджету {app.config["QUERY_BUDGET"]}')
+
+
+@app.cli.command('bench-seed')
+@click.option('--scale', type=float, default=0.01, help='Частка від 1M користувачів / 100k подій / 10M участей')
+@click.option('--seed', type=int, default=1)
+def bench_seed_command(scale, seed):
+    # Пакет bench імпортується лише командами bench-*: процеси gunicorn і воркер його не завантажують
+    import bench.seed
+    migrations.upgrade(db.engine, echo=click.echo)
+    sizes = bench.seed.seed(bench.seed.sizes_for(scale), seed=seed, echo=click.echo)
+    click.echo(f'Готово: {sizes}')
+
+
+@app.cli.command('bench-run')
+@click.option('--url', default=None, help='Вже запущений сервер; інакше стартує локальний gunicorn')
+@click.option('--workers', type=int, default=4)
+@click.option('--port', type=int, default=8123)
+@click.option('--scenarios', default=None, help='Через кому; за замовчуванням усі')
+@click.option('--concurrency', type=int, default=16)
+@click.option('--duration', type=int, default=20, help='Секунд на сценарій')
+def bench_run_command(url, workers, port, scenarios, concurrency, duration):
+    import bench.load
+    scenarios = [name for name in scenarios.split(',') if name] if scenarios else list(bench.load.SCENARIOS)
+    unknown = set(scenarios) - set(bench.load.SCENARIOS)
+    if unknown:
+        raise click.UsageError(f'Невідомі сценарії: {", ".join(sorted(unknown))}')
+
+    server = None
+    if url is None:
+        server, url = bench.load.start_server(app.config['SQLALCHEMY_DATABASE_URI'], port, workers)
+    try:
+        result = bench.load.run(url.rstrip('/'), scenarios, concurrency, duration, echo=click.echo,
+                                meta={'workers': workers if server else None})
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    click.echo(f'Результат: {bench.load.save(result)}')
+
+
+@app.cli.command('bench-nearby')
+@click.option('--points', type=int, default=200_000)
+@click.option('--events', type=int, default=5_000)
+@click.option('--repeats', type=int, default=20)
+def bench_nearby_command(points, events, repeats):
+    import bench.load
+    import bench.nearby
+    result = bench.nearby.run(points=points, events=events, repeats=repeats, echo=click.echo)
+    click.echo(f'Результат: {bench.load.save(result)}')
+
+
+@app.cli.command('bench-compare')
+@click.argument('baseline', type=click.Path(exists=True))
+@click.argument('current', type=click.Path(exists=True))
+@click.option('--threshold', type=float, default=0.10, help='Допустиме погіршення, частка')
+def bench_compare_command(baseline, current, threshold):
+    import bench.compare
+    baseline, current = bench.compare.load(baseline), bench.compare.load(current)
+    rows, regressions = bench.compare.compare(baseline, current, threshold)
+    click.echo(bench.compare.format_table(baseline, current, rows))
+    if regressions:
+        for regression in regressions:
+            click.echo(regression, err=True)
+        raise SystemExit(1)
 
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
-        init_achievements()
+        # Для gunicorn схему оновлює крок release з Procfile; тут — лише для локального запуску
+        migrations.upgrade(db.engine)
 
         if not User.query.filter_by(username='admin').first():
             admin = User(username='admin', email='admin@toloka.ua', full_name='Адміністратор')
@@ -0,0 +1,129 @@
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import Lock, BoundedSemaphore
+from flask_login import UserMixin
+from sqlalchemy import select, update
+from werkzeug.security import generate_password_hash, check_password_hash
+from models import db, User
+import fragcache
+
+
+class PasswordBusy(Exception):
+    pass
+
+
+class SessionUser(UserMixin):
+    # Легка проєкція для current_user: без password_hash і без привʼязки до сесії SQLAlchemy
+    def __init__(self, id, username, full_name, points):
+        self.id = id
+        self.username = username
+        self.full_name = full_name
+        self.points = points or 0
+
+
+SESSION_COLUMNS = (User.id, User.username, User.full_name, User.points)
+
+_app = None
+_cache = OrderedDict()
+_cache_lock = Lock()
+_pool = None
+_pool_pid = None
+_slots = None
+_method_prefix = None
+
+
+def init_app(app):
+    global _app
+    _app = app
+    app.config.setdefault('SESSION_USER_TTL', 30)
+    app.config.setdefault('SESSION_USER_CACHE_SIZE', 10000)
+    app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    app.config.setdefault('PASSWORD_WORKERS', 2)
+    app.config.setdefault('PASSWORD_QUEUE', 8)
+    app.config.setdefault('PASSWORD_TIMEOUT', 10)
+
+
+def _load(user_id):
+    row = db.session.execute(select(*SESSION_COLUMNS).where(User.id == user_id)).first()
+    return SessionUser(*row) if row else None
+
+
+def load_session_user(user_id):
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    # Будь-який комміт у таблицю user підвищує її версію (див. fragcache), тож баланс балів не застаріває
+    versions = fragcache.versions(('user',))
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry is not None and entry[0] > now and entry[1] == versions:
+            _cache.move_to_end(user_id)
+            return entry[2]
+
+    user = _load(user_id)
+    if user is not None:
+        with _cache_lock:
+            _cache[user_id] = (now + _app.config['SESSION_USER_TTL'], versions, user)
+            while len(_cache) > _app.config['SESSION_USER_CACHE_SIZE']:
+                _cache.popitem(last=False)
+    return user
+
+
+def _get_pool():
+    global _pool, _pool_pid, _slots
+    # Пул потоків створюється ліниво в кожному воркері gunicorn після fork
+    if _pool is None or _pool_pid != os.getpid():
+        workers = _app.config['PASSWORD_WORKERS']
+        _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password')
+        _slots = BoundedSemaphore(workers + _app.config['PASSWORD_QUEUE'])
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def _run(fn, *args):
+    # scrypt/pbkdf2 відпускають GIL, тож хешування в пулі не блокує інші потоки воркера;
+    # переповнена черга одразу дає PasswordBusy замість довгого очікування
+    pool = _get_pool()
+    if not _slots.acquire(blocking=False):
+        raise PasswordBusy()
+    future = pool.submit(fn, *args)
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=_app.config['PASSWORD_TIMEOUT'])
+    except TimeoutError:
+        raise PasswordBusy()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, _app.config['PASSWORD_HASH_METHOD'])
+
+
+def needs_rehash(password_hash):
+    global _method_prefix
+    # 'scrypt' у конфігурації зберігається як 'scrypt:32768:8:1', тож префікс береться з реального хешу
+    if _method_prefix is None:
+        _method_prefix = generate_password_hash('', _app.config['PASSWORD_HASH_METHOD']).split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != _method_prefix
+
+
+def authenticate(username, password):
+    row = db.session.execute(
+        select(User.id, User.password_hash).where(User.username == username)
+    ).first()
+    if row is None or not _run(check_password_hash, row.password_hash, password):
+        return None
+
+    if needs_rehash(row.password_hash):
+        # Новий PASSWORD_HASH_METHOD застосовується під час входу, без примусової зміни паролів
+        db.session.execute(
+            update(User)
+            .where(User.id == row.id, User.password_hash == row.password_hash)
+            .values(password_hash=hash_password(password))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    return load_session_user(row.id)
@@ -0,0 +1,45 @@
+import json
+import math
+
+# Для цих метрик більше — гірше; для пропускної здатності навпаки
+LOWER_IS_BETTER = ('p50_ms', 'p99_ms', 'queries_per_request')
+METRICS = ('throughput_rps',) + LOWER_IS_BETTER
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.10):
+    rows = []
+    regressions = []
+    for scenario in sorted(set(baseline['scenarios']) & set(current['scenarios'])):
+        before, after = baseline['scenarios'][scenario], current['scenarios'][scenario]
+        for metric in METRICS:
+            old, new = before.get(metric), after.get(metric)
+            if old is None or new is None:
+                continue
+            if old:
+                change = (new - old) / old
+            else:
+                # Від нульової бази відносна зміна нескінченна: 0 → 3 запити на сторінку — регресія
+                change = 0.0 if new == old else math.copysign(math.inf, new - old)
+            worse = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+            rows.append((scenario, metric, old, new, change, worse))
+            if worse:
+                regressions.append(f'{scenario}.{metric}: {old} → {new} ({_percent(change, 0)})')
+    return rows, regressions
+
+
+def _percent(change, digits):
+    if math.isinf(change):
+        return '+∞' if change > 0 else '−∞'
+    return f'{change:+.{digits}%}'
+
+
+def format_table(baseline, current, rows):
+    lines = [f'{baseline["commit"]} → {current["commit"]}']
+    for scenario, metric, old, new, change, worse in rows:
+        lines.append(f'{scenario:12} {metric:20} {old:>10} {new:>10} {_percent(change, 1):>8}{"  ✗" if worse else ""}')
+    return '\n'.join(lines)
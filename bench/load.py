@@ -0,0 +1,217 @@
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from models import db, User, Event
+from bench.seed import PASSWORD
+
+SCENARIOS = ('index', 'leaderboard', 'map', 'calendar', 'join', 'complete')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # 302 після POST — це успішна відповідь форми, переходити за нею не треба
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Client:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+
+    def request(self, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        started = time.perf_counter()
+        try:
+            response = self.opener.open(self.base_url + path, data=body, timeout=30)
+            status, headers = response.status, response.headers
+            response.read()
+        except urllib.error.HTTPError as error:
+            status, headers = error.code, error.headers
+            error.read()
+        except OSError:
+            return time.perf_counter() - started, 0, None
+        queries = headers.get('X-Query-Count')
+        return time.perf_counter() - started, status, int(queries) if queries is not None else None
+
+    def login(self, username):
+        _, status, _ = self.request('/login', {'username': username, 'password': PASSWORD})
+        return status == 302
+
+
+def targets(rng, planned_limit=5000):
+    # Ідентифікатори беруться з бази до запуску, щоб клієнти не витрачали на це час
+    planned = db.session.execute(
+        select(Event.id, Event.creator_id).where(Event.status == 'planned').limit(planned_limit)
+    ).all()
+    if not planned:
+        raise RuntimeError('У базі немає запланованих подій — спочатку виконайте bench-seed')
+    users = db.session.execute(select(db.func.max(User.id))).scalar()
+    rng.shuffle(planned)
+    return planned, users
+
+
+def _paths(scenario, rng):
+    if scenario == 'index':
+        return ['/']
+    if scenario == 'leaderboard':
+        return ['/leaderboard']
+    if scenario == 'map':
+        lat, lon = rng.uniform(46.5, 50.5), rng.uniform(24.0, 36.0)
+        return ['/map', f'/api/map?bbox={lon - 0.5:.4f},{lat - 0.3:.4f},{lon + 0.5:.4f},{lat + 0.3:.4f}&zoom=10']
+    if scenario == 'calendar':
+        start = (datetime.utcnow().date().replace(day=1) + timedelta(days=31 * rng.randint(0, 3))).replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+        return ['/calendar', f'/api/calendar?start={start.isoformat()}&end={end.isoformat()}']
+    raise ValueError(scenario)
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(samples, elapsed):
+    latencies = [latency for latency, status, _ in samples if 0 < status < 400]
+    queries = [count for _, status, count in samples if count is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status, _ in samples if not 0 < status < 400),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+
+
+def run_scenario(base_url, scenario, concurrency, duration, planned, users, seed=1):
+    stop = time.monotonic() + duration
+    samples = []
+    lock = threading.Lock()
+    # Кожна подія завершується один раз, тож завершення беруть події з однієї спільної черги
+    pending = list(planned)
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = Client(base_url)
+        local = []
+        if scenario == 'join' and not client.login(f'bench{rng.randint(1, users)}'):
+            return
+        logged_in_as = None
+        while time.monotonic() < stop:
+            if scenario == 'join':
+                event_id, _ = rng.choice(planned)
+                local.append(client.request(f'/events/{event_id}/join', {}))
+                if len(local) % 20 == 0:
+                    # Новий користувач, щоб не впиратися в «вже зареєстровані»
+                    client = Client(base_url)
+                    client.login(f'bench{rng.randint(1, users)}')
+            elif scenario == 'complete':
+                with lock:
+                    if not pending:
+                        break
+                    event_id, creator_id = pending.pop()
+                if logged_in_as != creator_id:
+                    client = Client(base_url)
+                    client.login(f'bench{creator_id}')
+                    logged_in_as = creator_id
+                local.append(client.request(f'/events/{event_id}/complete',
+                                            {'waste_collected': rng.randint(5, 300), 'area_cleaned': rng.randint(50, 3000)}))
+            else:
+                for path in _paths(scenario, rng):
+                    local.append(client.request(path))
+        with lock:
+            samples.extend(local)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, time.monotonic() - started)
+
+
+def start_server(database_url, port, workers, extra_env=None):
+    env = dict(os.environ, DATABASE_URL=database_url, QUERY_BUDGET=os.environ.get('QUERY_BUDGET', '100000'),
+               IMAGE_WORKERS='0', **(extra_env or {}))
+    process = subprocess.Popen(
+        # Як web у Procfile: потоки gthread ділять пул хешування паролів (auth.py)
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '--worker-class', 'gthread', '--threads', '16',
+         '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'],
+        env=env, cwd=ROOT,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn завершився під час запуску')
+        try:
+            urllib.request.urlopen(base_url + '/api/stats', timeout=1).read()
+            return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.send_signal(signal.SIGTERM)
+    raise RuntimeError('gunicorn не відповів за 30 с')
+
+
+def git_revision():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return revision, dirty
+
+
+def run(base_url, scenarios, concurrency, duration, echo=print, meta=None):
+    rng = random.Random(1)
+    planned, users = targets(rng)
+    # complete витрачає події назавжди, тож воно йде останнім і бере власну частину списку
+    complete_pool, join_pool = planned[:len(planned) // 2], planned[len(planned) // 2:] or planned
+    revision, dirty = git_revision()
+    result = {
+        'commit': revision,
+        'dirty': dirty,
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': db.engine.dialect.name,
+        'concurrency': concurrency,
+        'duration_s': duration,
+        'scenarios': {},
+    }
+    result.update(meta or {})
+    for scenario in sorted(scenarios, key=SCENARIOS.index):
+        pool = complete_pool if scenario == 'complete' else join_pool
+        summary = run_scenario(base_url, scenario, concurrency, duration, pool, users)
+        result['scenarios'][scenario] = summary
+        echo(f'{scenario:12} {summary["throughput_rps"]:>8} rps  p50 {summary["p50_ms"]} ms  '
+             f'p99 {summary["p99_ms"]} ms  queries {summary["queries_per_request"]}  errors {summary["errors"]}')
+    return result
+
+
+def save(result, directory=RESULTS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    stamp = result['created_at'].replace(':', '').replace('-', '')
+    path = os.path.join(directory, f'{result["commit"]}{"-dirty" if result["dirty"] else ""}-{stamp}.json')
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    return path
@@ -0,0 +1,83 @@
+import time
+from datetime import datetime
+import numpy as np
+from sqlalchemy import select, func
+from models import db, PollutedPlace
+from bench.load import git_revision, summarize
+import geo
+import nearby
+
+
+def _timed(fn, repeats):
+    samples = []
+    started = time.monotonic()
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0, 200, None))
+    return summarize(samples, time.monotonic() - started)
+
+
+def synthetic(points, seed=1):
+    rng = np.random.default_rng(seed)
+    # Точки навколо Києва в квадраті ~100 км
+    return rng.uniform(50.0, 50.9, points), rng.uniform(30.0, 31.1, points)
+
+
+def run(points=200_000, events=5_000, radius_m=5000, limit=20, repeats=20, echo=print):
+    lats, lons = synthetic(points)
+    ids = np.arange(1, points + 1)
+    event_lats, event_lons = synthetic(events, seed=2)
+    lat, lon = 50.45, 30.52
+
+    def python_rank():
+        # Базова лінія: по одній відстані на рядок у циклі Python
+        found = [(geo.distance_m(lat, lon, a, b), i) for i, a, b in zip(ids.tolist(), lats.tolist(), lons.tolist())]
+        return sorted(d for d in found if d[0] <= radius_m)[:limit]
+
+    def numpy_rank():
+        return nearby.rank(lat, lon, radius_m, ids, lats, lons, limit)
+
+    place_count = min(points, 20_000)
+
+    def python_match():
+        targets = list(zip(event_lats.tolist(), event_lons.tolist()))
+        return [min(geo.distance_m(a, b, c, d) for c, d in targets)
+                for a, b in zip(lats[:place_count // 20].tolist(), lons[:place_count // 20].tolist())]
+
+    def numpy_match():
+        return nearby.nearest(lats[:place_count], lons[:place_count], event_lats, event_lons)
+
+    expected = [i for _, i in python_rank()]
+    assert expected == numpy_rank()[0].tolist(), 'NumPy і Python дають різний порядок'
+
+    scenarios = {
+        f'rank_python_{points}': _timed(python_rank, max(1, repeats // 10)),
+        f'rank_numpy_{points}': _timed(numpy_rank, repeats),
+        # Python-цикл на 1/20 місць — повний прогін тривав би хвилини
+        f'match_python_{place_count // 20}x{events}': _timed(python_match, 1),
+        f'match_numpy_{place_count}x{events}': _timed(numpy_match, max(1, repeats // 5)),
+    }
+
+    # Наскрізно через базу, якщо bench-seed вже заповнив місця
+    if db.session.execute(select(func.count(PollutedPlace.id))).scalar():
+        for radius in (1000, 5000, 20000):
+            scenarios[f'search_db_{radius}m'] = _timed(
+                lambda: nearby.search(lat, lon, radius, ['places', 'events'], limit=limit, match_radius_m=2000),
+                repeats)
+            db.session.rollback()
+
+    for name, summary in scenarios.items():
+        echo(f'{name:32} p50 {summary["p50_ms"]} ms  p99 {summary["p99_ms"]} ms')
+
+    revision, dirty = git_revision()
+    return {
+        'commit': revision,
+        'dirty': dirty,
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'database': db.engine.dialect.name,
+        'benchmark': 'nearby',
+        'points': points,
+        'events': events,
+        'scenarios': scenarios,
+    }
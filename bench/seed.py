@@ -0,0 +1,141 @@
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, func
+from werkzeug.security import generate_password_hash
+from models import db, User, Event, Team, PollutedPlace, event_participants, team_members
+from stats import reconcile_stats
+import geo
+import leaderboard
+
+# Масштаб 1.0 відповідає цільовому навантаженню; --scale 0.01 дає швидкий локальний набір
+FULL_SCALE = {
+    'users': 1_000_000,
+    'teams': 20_000,
+    'events': 100_000,
+    'participations': 10_000_000,
+    'places': 500_000,
+}
+CITIES = {
+    'Київ': (50.45, 30.52),
+    'Львів': (49.84, 24.03),
+    'Харків': (49.99, 36.23),
+    'Одеса': (46.48, 30.72),
+    'Дніпро': (48.46, 35.05),
+}
+PASSWORD = 'bench'
+CHUNK = 10_000
+
+
+def sizes_for(scale):
+    return {name: max(1, int(count * scale)) for name, count in FULL_SCALE.items()}
+
+
+def _insert(table, rows):
+    # rows — генератор, тож у памʼяті одночасно лише одна пачка
+    batch = []
+    total = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= CHUNK:
+            db.session.execute(insert(table), batch)
+            db.session.commit()
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(table), batch)
+        db.session.commit()
+        total += len(batch)
+    return total
+
+
+def _point(rng):
+    city, (lat, lon) = rng.choice(list(CITIES.items()))
+    lat += rng.uniform(-0.2, 0.2)
+    lon += rng.uniform(-0.3, 0.3)
+    return city, lat, lon
+
+
+def seed(sizes, seed=1, echo=print):
+    if db.session.execute(select(func.count(User.id))).scalar():
+        raise RuntimeError('База не порожня: бенчмарк заповнює лише чисту базу')
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(db.text('PRAGMA journal_mode=WAL'))
+        db.session.execute(db.text('PRAGMA synchronous=OFF'))
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    # Один хеш на всіх: інакше заповнення впирається в scrypt, а не в базу
+    password_hash = generate_password_hash(PASSWORD)
+
+    def step(name, table, rows):
+        started = time.monotonic()
+        total = _insert(table, rows)
+        echo(f'{name}: {total} за {time.monotonic() - started:.1f} с')
+
+    step('users', User.__table__, ({
+        'id': i, 'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password_hash': password_hash,
+        'full_name': f'Учасник {i}', 'points': rng.randint(0, 5000), 'events_count': rng.randint(0, 50),
+        'total_waste': rng.uniform(0, 500), 'total_area': rng.uniform(0, 2000),
+        'created_at': now - timedelta(days=rng.randint(0, 700)),
+    } for i in range(1, sizes['users'] + 1)))
+
+    step('teams', Team.__table__, ({
+        'id': i, 'name': f'Команда {i}', 'captain_id': rng.randint(1, sizes['users']),
+        'points': rng.randint(0, 50000), 'events_count': rng.randint(0, 200),
+    } for i in range(1, sizes['teams'] + 1)))
+
+    step('team_members', team_members, ({
+        'user_id': user_id, 'team_id': rng.randint(1, sizes['teams']),
+    } for user_id in range(1, sizes['users'] + 1, 2)))
+
+    # Кількість учасників розподілена нерівномірно, але не перевищує max_participants
+    per_event = sizes['participations'] / sizes['events']
+    capacities = [rng.choice([None, 50, 200, 1000]) for _ in range(sizes['events'])]
+    counts = [min(capacity or sizes['users'], sizes['users'], int(rng.expovariate(1 / per_event)))
+              for capacity in capacities]
+
+    def events():
+        for i in range(1, sizes['events'] + 1):
+            city, lat, lon = _point(rng)
+            completed = rng.random() < 0.6
+            date = now - timedelta(days=rng.randint(1, 365)) if completed else now + timedelta(days=rng.randint(1, 120))
+            yield {
+                'id': i, 'title': f'Толока {i}', 'location': f'{city}, локація {i}',
+                'latitude': lat, 'longitude': lon, 'geohash': geo.encode(lat, lon),
+                'date': date.replace(minute=0, second=0, microsecond=0), 'duration': 120,
+                'max_participants': capacities[i - 1],
+                'waste_collected': rng.uniform(10, 500) if completed else 0.0,
+                'area_cleaned': rng.uniform(100, 5000) if completed else 0.0,
+                'status': 'completed' if completed else 'planned',
+                'creator_id': rng.randint(1, sizes['users']),
+                'team_id': rng.choice([None, rng.randint(1, sizes['teams'])]),
+                'created_at': now - timedelta(days=400), 'updated_at': now, 'participants_count': counts[i - 1],
+            }
+
+    def participations():
+        joined_at = now - timedelta(days=400)
+        for event_id, count in enumerate(counts, start=1):
+            for user_id in rng.sample(range(1, sizes['users'] + 1), count):
+                yield {'user_id': user_id, 'event_id': event_id, 'joined_at': joined_at}
+
+    def places():
+        for i in range(1, sizes['places'] + 1):
+            _, lat, lon = _point(rng)
+            yield {
+                'id': i, 'title': f'Забруднення {i}', 'latitude': lat, 'longitude': lon,
+                'geohash': geo.encode(lat, lon), 'severity': rng.choice(('low', 'medium', 'high', 'critical')),
+                'reporter_id': rng.randint(1, sizes['users']),
+                'status': rng.choice(('reported', 'reported', 'planned', 'cleaned')),
+                'created_at': now - timedelta(days=rng.randint(0, 365)),
+            }
+
+    step('events', Event.__table__, events())
+    step('event_participants', event_participants, participations())
+    step('places', PollutedPlace.__table__, places())
+
+    reconcile_stats()
+    for model in (User, Team):
+        leaderboard.rebuild_tree(db.session, model)
+    db.session.commit()
+    return sizes
@@ -0,0 +1,160 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, date, timezone
+from sqlalchemy import select, tuple_
+from models import db, User, Event, PollutedPlace, event_participants
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'geojson': 'application/geo+json',
+}
+
+
+def _datasets():
+    # назва: (колонки, ключ для відновлення, колонка для updated_since, координати для GeoJSON)
+    return {
+        'events': (
+            (Event.id, Event.title, Event.description, Event.location, Event.latitude, Event.longitude,
+             Event.date, Event.duration, Event.status, Event.max_participants, Event.participants_count,
+             Event.waste_collected, Event.area_cleaned, Event.team_id, Event.creator_id,
+             Event.created_at, Event.updated_at),
+            (Event.id,), Event.updated_at, ('latitude', 'longitude'),
+        ),
+        # Порядок первинного ключа таблиці звʼязку: (user_id, event_id)
+        'participants': (
+            (event_participants.c.user_id, event_participants.c.event_id, event_participants.c.joined_at),
+            (event_participants.c.user_id, event_participants.c.event_id), event_participants.c.joined_at, None,
+        ),
+        'places': (
+            (PollutedPlace.id, PollutedPlace.title, PollutedPlace.description, PollutedPlace.latitude,
+             PollutedPlace.longitude, PollutedPlace.severity, PollutedPlace.status, PollutedPlace.reporter_id,
+             PollutedPlace.created_at, PollutedPlace.updated_at),
+            (PollutedPlace.id,), PollutedPlace.updated_at, ('latitude', 'longitude'),
+        ),
+        'users': (
+            (User.id, User.username, User.full_name, User.points, User.events_count, User.total_waste,
+             User.total_area, User.created_at, User.updated_at),
+            (User.id,), User.updated_at, None,
+        ),
+    }
+
+
+DATASETS = tuple(_datasets())
+
+
+def has_geometry(name):
+    return _datasets()[name][3] is not None
+
+
+def parse_since(value):
+    # ISO 8601; час із зоною переводиться в наївний UTC, як у базі
+    since = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
+
+def parse_after(name, value):
+    # Ключ останнього отриманого рядка: '15' або 'user_id:event_id' для participants
+    size = len(_datasets()[name][1])
+    parts = value.split(':')
+    if len(parts) != size:
+        raise ValueError(value)
+    return tuple(int(part) for part in parts)
+
+
+def _key(name, row):
+    return ':'.join(str(getattr(row, column.name)) for column in _datasets()[name][1])
+
+
+def _value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def rows(name, updated_since=None, after=None, chunk=1000):
+    columns, key, updated, _ = _datasets()[name]
+    query = select(*columns).order_by(*key)
+    if updated_since is not None:
+        query = query.where(updated >= updated_since)
+    if after is not None:
+        query = query.where(tuple_(*key) > tuple_(*after))
+    # yield_per вмикає серверний курсор: у памʼяті лише одна пачка рядків
+    return db.session.execute(query.execution_options(yield_per=chunk))
+
+
+def _encoder(name, fmt):
+    columns = [column.name for column in _datasets()[name][0]]
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def encode(row):
+            writer.writerow(['' if value is None else _value(value) for value in row])
+            text = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return text
+        return encode(columns), encode, ''
+
+    if fmt == 'ndjson':
+        def encode(row):
+            return json.dumps(dict(zip(columns, map(_value, row))), ensure_ascii=False) + '\n'
+        return '', encode, ''
+
+    lat_name, lon_name = _datasets()[name][3]
+    first = [True]
+
+    def encode(row):
+        properties = dict(zip(columns, map(_value, row)))
+        lat, lon = properties.pop(lat_name), properties.pop(lon_name)
+        feature = {
+            'type': 'Feature',
+            'id': row.id,
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]} if lat is not None and lon is not None else None,
+            'properties': properties,
+        }
+        separator = '' if first[0] else ',\n'
+        first[0] = False
+        return separator + json.dumps(feature, ensure_ascii=False)
+    return '{"type": "FeatureCollection", "features": [\n', encode, '\n]}\n'
+
+
+def stream(name, fmt, updated_since=None, after=None, chunk=1000, compress=False, on_chunk=None):
+    # Віддає байти пачками; gzip скидається після кожної пачки (Z_SYNC_FLUSH), тож перервана
+    # передача містить цілі рядки до останньої пачки, а on_chunk отримує ключ для відновлення
+    header, encode, footer = _encoder(name, fmt)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def output(text, final=False):
+        data = text.encode('utf-8')
+        if compressor is None:
+            return data
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+    if header:
+        yield output(header)
+    parts = []
+    count = 0
+    last = None
+    for row in rows(name, updated_since, after, chunk):
+        parts.append(encode(row))
+        last = row
+        if len(parts) >= chunk:
+            yield output(''.join(parts))
+            count += len(parts)
+            parts = []
+            if on_chunk:
+                on_chunk(count, _key(name, last))
+    if parts:
+        yield output(''.join(parts))
+        count += len(parts)
+        if on_chunk:
+            on_chunk(count, _key(name, last))
+    tail = output(footer, final=True)
+    if tail:
+        yield tail
@@ -0,0 +1,291 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from itertools import chain
+from threading import Lock
+from flask import has_request_context
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+
+def _new_version():
+    # Унікальне значення замість лічильника: підвищення версії не потребує читання
+    return f'{time.time_ns():x}.{os.getpid():x}'
+
+
+class MemoryBackend:
+    # LRU в памʼяті процесу: кожен воркер gunicorn має власний кеш і власні версії тегів
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def versions(self, tags):
+        with self._lock:
+            return [self._versions.get(tag, '0') for tag in tags]
+
+    def bump(self, tags):
+        version = _new_version()
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = version
+
+
+class FileBackend:
+    # Спільний каталог: усі воркери на одній машині бачать ті самі фрагменти й версії
+    def __init__(self, root, max_entries=2048, sweep_interval=60):
+        self.root = root
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._sweep_lock = Lock()
+        os.makedirs(os.path.join(root, 'tags'), exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _write(self, path, data, expires=None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+        if expires is not None:
+            # mtime фрагмента — час його закінчення: прибирання обходиться stat без читання файлів
+            os.utime(temp_path, (expires, expires))
+        os.replace(temp_path, path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                expires, value = f.read().split('\n', 1)
+        except (OSError, ValueError):
+            return None
+        if float(expires) < time.time():
+            self._remove(path)
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        expires = time.time() + ttl
+        self._write(self._path(key), f'{expires}\n{value}', expires)
+        if time.monotonic() >= self._next_sweep and self._sweep_lock.acquire(blocking=False):
+            try:
+                self._next_sweep = time.monotonic() + self.sweep_interval
+                self.sweep()
+            finally:
+                self._sweep_lock.release()
+
+    def sweep(self):
+        # Прострочені файли видаляються; понад max_entries — ті, що закінчуються найраніше
+        now = time.time()
+        live = []
+        removed = 0
+        for shard in os.scandir(self.root):
+            if shard.name == 'tags' or not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                if entry.name.startswith('.tmp'):
+                    # Незавершений запис іншого процесу; залишки після збою прибираються за годину
+                    if mtime < now - 3600:
+                        self._remove(entry.path)
+                        removed += 1
+                elif mtime < now:
+                    self._remove(entry.path)
+                    removed += 1
+                else:
+                    live.append((mtime, entry.path))
+        if len(live) > self.max_entries:
+            live.sort()
+            for _, path in live[:len(live) - self.max_entries]:
+                self._remove(path)
+                removed += 1
+        return removed
+
+    def versions(self, tags):
+        result = []
+        for tag in tags:
+            try:
+                with open(os.path.join(self.root, 'tags', tag)) as f:
+                    result.append(f.read())
+            except OSError:
+                result.append('0')
+        return result
+
+    def bump(self, tags):
+        version = _new_version()
+        for tag in tags:
+            self._write(os.path.join(self.root, 'tags', tag), version)
+
+
+class RedisBackend:
+    def __init__(self, url, prefix='toloka:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(f'{self.prefix}frag:{key}')
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(f'{self.prefix}frag:{key}', value.encode('utf-8'), ex=int(ttl))
+
+    def versions(self, tags):
+        if not tags:
+            return []
+        values = self.client.mget([f'{self.prefix}tag:{tag}' for tag in tags])
+        return [value.decode() if value is not None else '0' for value in values]
+
+    def bump(self, tags):
+        version = _new_version()
+        self.client.mset({f'{self.prefix}tag:{tag}': version for tag in tags})
+
+
+_backend = None
+_default_ttl = 60
+
+
+def versions(tags):
+    return tuple(_backend.versions(tags)) if _backend is not None else ()
+
+
+def invalidate(*tags):
+    if _backend is not None and tags:
+        _backend.bump(sorted(tags))
+
+
+def _audience():
+    if has_request_context() and current_user.is_authenticated:
+        return 'auth'
+    return 'anon'
+
+
+def fragment(name, tags, vary, ttl, render):
+    if _backend is None:
+        return render()
+    tags = list(tags)
+    # Версії тегів входять у ключ, тож після зміни даних старі записи просто перестають читатися
+    raw = json.dumps([name, _audience(), list(vary), tags, _backend.versions(tags)], default=str)
+    key = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    value = _backend.get(key)
+    if value is None:
+        value = str(render())
+        _backend.set(key, value, ttl or _default_ttl)
+    return Markup(value)
+
+
+class FragmentCacheExtension(Extension):
+    # {% cache 'назва', tags=['event'], vary=[...], ttl=60 %} ... {% endcache %}
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        kwargs = []
+        while parser.stream.skip_if('comma'):
+            key = parser.stream.expect('name').value
+            parser.stream.expect('assign')
+            kwargs.append(nodes.Keyword(key, parser.parse_expression()))
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', args, kwargs), [], [], body).set_lineno(lineno)
+
+    def _render(self, name, tags=(), vary=(), ttl=None, caller=None):
+        return fragment(name, tags, vary, ttl, caller)
+
+
+def _tags(session):
+    return session.info.setdefault('cache_tags', set())
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed(session, flush_context):
+    tags = _tags(session)
+    for obj in chain(session.new, session.dirty, session.deleted):
+        state = inspect(obj)
+        tags.add(state.mapper.local_table.name)
+        # Зміни колекцій many-to-many пишуть у таблиці звʼязку, а не в таблицю моделі
+        for relationship in state.mapper.relationships:
+            if relationship.secondary is not None and state.attrs[relationship.key].history.has_changes():
+                tags.add(relationship.secondary.name)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_executed(orm_execute_state):
+    # Масові UPDATE/INSERT через session.execute обходять flush, тож тег береться з самої інструкції
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if getattr(table, 'name', None):
+            _tags(orm_execute_state.session).add(table.name)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_committed(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        invalidate(*tags)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _discard_rolled_back(session, transaction):
+    # Відкат точки збереження не скасовує зміни зовнішньої транзакції, тому теги чистяться лише в кінці кореневої
+    if transaction.parent is None:
+        session.info.pop('cache_tags', None)
+
+
+def init_app(app):
+    global _backend, _default_ttl
+    app.config.setdefault('FRAGMENT_CACHE', 'memory')
+    app.config.setdefault('FRAGMENT_CACHE_SIZE', 2048)
+    app.config.setdefault('FRAGMENT_CACHE_TTL', 60)
+    app.config.setdefault('FRAGMENT_CACHE_SWEEP', 60)
+    _default_ttl = app.config['FRAGMENT_CACHE_TTL']
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+    storage = app.config['FRAGMENT_CACHE']
+    if storage == 'none':
+        _backend = None
+    elif storage.startswith('filesystem://'):
+        _backend = FileBackend(storage[len('filesystem://'):], app.config['FRAGMENT_CACHE_SIZE'],
+                               app.config['FRAGMENT_CACHE_SWEEP'])
+    elif storage.startswith(('redis://', 'rediss://', 'unix://')):
+        _backend = RedisBackend(storage)
+    else:
+        _backend = MemoryBackend(app.config['FRAGMENT_CACHE_SIZE'])
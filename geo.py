@@ -0,0 +1,91 @@
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9
+EARTH_RADIUS_M = 6371000.0
+
+# Розмір комірки geohash (висота, ширина) у градусах для кожної точності
+CELL_SIZE = {p: (180.0 / 2 ** ((5 * p) // 2), 360.0 / 2 ** ((5 * p + 1) // 2)) for p in range(1, 13)}
+
+
+def encode(lat, lon, precision=PRECISION):
+    if lat is None or lon is None:
+        return None
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            rng[0] = mid
+        else:
+            bits = bits * 2
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def parse_bbox(value):
+    # "захід,південь,схід,північ" -> кортеж або None
+    try:
+        west, south, east, north = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        return None
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180 and west <= east):
+        return None
+    return west, south, east, north
+
+
+def cover_precision(bbox, max_cells=32):
+    west, south, east, north = bbox
+    for precision in range(PRECISION, 0, -1):
+        height, width = CELL_SIZE[precision]
+        cells = (math.floor(north / height) - math.floor(south / height) + 1) * \
+                (math.floor(east / width) - math.floor(west / width) + 1)
+        if cells <= max_cells:
+            return precision
+    return 1
+
+
+def cover(bbox, precision=None):
+    # Набір префіксів geohash, комірки яких разом покривають bbox
+    precision = precision or cover_precision(bbox)
+    west, south, east, north = bbox
+    height, width = CELL_SIZE[precision]
+    cells = set()
+    lat = math.floor(south / height) * height
+    while lat <= north:
+        lon = math.floor(west / width) * width
+        while lon <= east:
+            cells.add(encode(min(lat + height / 2, 90.0), min(lon + width / 2, 180.0), precision))
+            lon += width
+        lat += height
+    return sorted(cells)
+
+
+def cluster_precision(zoom):
+    # Приблизно одна комірка на 64 пікселі екрана
+    return max(1, min(PRECISION, int(zoom * 0.4) + 1))
+
+
+def around(lat, lon, radius_m):
+    # bbox навколо точки з запасом на радіус
+    dlat = radius_m / 111320.0
+    dlon = radius_m / (111320.0 * max(math.cos(math.radians(lat)), 0.01))
+    return (max(lon - dlon, -180.0), max(lat - dlat, -90.0), min(lon + dlon, 180.0), min(lat + dlat, 90.0))
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
@@ -0,0 +1,105 @@
+import hashlib
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from sqlalchemy import select, func
+from models import db, Event, event_participants
+
+UTC = ZoneInfo('UTC')
+
+STATUS = {'planned': 'CONFIRMED', 'completed': 'CONFIRMED', 'cancelled': 'CANCELLED'}
+
+
+def _escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def _fold(line):
+    # RFC 5545: рядки довші за 75 байт переносяться з пробілом на початку продовження
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(encoded))
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _local_to_utc(value, zone):
+    # Дата толоки — місцевий час без зони; у стрічці вона віддається в UTC, тож VTIMEZONE не потрібен
+    return value.replace(tzinfo=zone).astimezone(UTC).replace(tzinfo=None)
+
+
+def _utc(value):
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def feed_filter(kind, value, history=timedelta(days=90)):
+    conditions = [Event.date >= datetime.utcnow() - history]
+    if kind == 'user':
+        conditions.append(Event.id.in_(
+            select(event_participants.c.event_id).where(event_participants.c.user_id == value)
+        ))
+    elif kind == 'team':
+        conditions.append(Event.team_id == value)
+    elif kind == 'city':
+        # % і _ у назві міста — звичайні символи, а не шаблон LIKE
+        pattern = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conditions.append(Event.location.ilike(f'%{pattern}%', escape='\\'))
+    return conditions
+
+
+def validators(conditions, key):
+    # Один агрегатний запит визначає, чи змінилась стрічка, без генерації самого календаря
+    count, last_modified = db.session.execute(
+        select(func.count(Event.id), func.max(func.coalesce(Event.updated_at, Event.created_at)))
+        .where(*conditions)
+    ).one()
+    last_modified = last_modified or datetime(2025, 1, 1)
+    etag = hashlib.sha1(f'{key}|{count}|{last_modified.isoformat()}'.encode()).hexdigest()
+    return etag, last_modified
+
+
+def generate(conditions, name, timezone, url_for_event, host):
+    yield _fold('BEGIN:VCALENDAR')
+    yield _fold('VERSION:2.0')
+    yield _fold('PRODID:-//Toloka//Calendar//UK')
+    yield _fold('CALSCALE:GREGORIAN')
+    yield _fold(f'X-WR-CALNAME:{_escape(name)}')
+    yield _fold(f'X-WR-TIMEZONE:{timezone}')
+    zone = ZoneInfo(timezone)
+
+    rows = db.session.execute(
+        select(Event.id, Event.title, Event.description, Event.location, Event.date, Event.duration,
+               Event.status, Event.latitude, Event.longitude, Event.created_at, Event.updated_at)
+        .where(*conditions)
+        .order_by(Event.date)
+        .execution_options(yield_per=500)
+    )
+    for event in rows:
+        start = _local_to_utc(event.date, zone)
+        end = start + timedelta(minutes=event.duration or 120)
+        lines = [
+            'BEGIN:VEVENT',
+            f'UID:event-{event.id}@{host}',
+            f'DTSTAMP:{_utc(event.updated_at or event.created_at)}',
+            f'DTSTART:{_utc(start)}',
+            f'DTEND:{_utc(end)}',
+            f'SUMMARY:{_escape(event.title)}',
+            f'LOCATION:{_escape(event.location)}',
+            f'STATUS:{STATUS.get(event.status, "CONFIRMED")}',
+            f'URL:{url_for_event(event.id)}',
+        ]
+        if event.description:
+            lines.append(f'DESCRIPTION:{_escape(event.description)}')
+        if event.latitude is not None and event.longitude is not None:
+            lines.append(f'GEO:{event.latitude:.6f};{event.longitude:.6f}')
+        lines.append('END:VEVENT')
+        yield ''.join(_fold(line) for line in lines)
+
+    yield _fold('END:VCALENDAR')
@@ -0,0 +1,148 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from PIL import Image, ImageOps
+from sqlalchemy import update
+from models import db, Event
+import storage
+import metrics
+
+# Ширина кожного варіанта в пікселях (найбільша сторона не перевищує це значення)
+VARIANTS = {'thumb': 320, 'card': 640, 'full': 1280}
+FORMATS = {'jpg': ('JPEG', {'optimize': True, 'quality': 85}), 'webp': ('WEBP', {'quality': 80, 'method': 4})}
+IMAGE_FIELDS = ('image_before', 'image_after')
+
+_app = None
+_pool = None
+_pool_pid = None
+
+
+def variant_key(key, variant, ext):
+    stem = key.rsplit('.', 1)[0]
+    return f'{stem}_{variant}.{ext}'
+
+
+def variant_keys(key):
+    return [variant_key(key, variant, ext) for variant in VARIANTS for ext in FORMATS]
+
+
+def render_variants(source_path, out_dir):
+    # Виконується в окремому процесі: тільки PIL і файлова система
+    rendered = []
+    with Image.open(source_path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', img.size, 'white')
+            rgba = img.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            img = background
+        for variant, width in VARIANTS.items():
+            copy = img.copy()
+            copy.thumbnail((width, width), Image.Resampling.LANCZOS)
+            for ext, (image_format, options) in FORMATS.items():
+                path = os.path.join(out_dir, f'{variant}.{ext}')
+                copy.save(path, image_format, **options)
+                rendered.append((variant, ext, path))
+    return rendered
+
+
+def init_app(app):
+    global _app
+    _app = app
+    app.config.setdefault('IMAGE_WORKERS', 2)
+    app.jinja_env.globals['image_sources'] = image_sources
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    # Пул створюється ліниво в кожному воркері gunicorn після fork. Процеси пулу стартують через
+    # forkserver: fork багатопотокового воркера gthread успадкував би замки, захоплені іншими потоками
+    if _pool is None or _pool_pid != os.getpid():
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _pool = ProcessPoolExecutor(max_workers=_app.config['IMAGE_WORKERS'],
+                                    mp_context=multiprocessing.get_context(method))
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def _set_status(event_id, field, key, status):
+    column = getattr(Event, field)
+    db.session.execute(
+        update(Event)
+        .where(Event.id == event_id, column == key)
+        .values({f'{field}_status': status})
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def _publish(key, rendered):
+    backend = storage.backend()
+    for variant, ext, path in rendered:
+        backend.put_file(variant_key(key, variant, ext), path)
+
+
+def _finish(event_id, field, key, work_dir, started, future):
+    with _app.app_context():
+        try:
+            _publish(key, future.result())
+        except Exception as error:
+            _app.logger.error('Image processing failed for %s: %r', key, error)
+            _set_status(event_id, field, key, 'failed')
+            metrics.observe('toloka_image_processing_seconds', time.monotonic() - started, status='failed')
+        else:
+            _app.logger.info('Processed %s in %.2fs', key, time.monotonic() - started)
+            _set_status(event_id, field, key, 'ready')
+            metrics.observe('toloka_image_processing_seconds', time.monotonic() - started, status='ready')
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def submit(event_id, field, key):
+    backend = storage.backend()
+    # Однаковий вміст має однаковий ключ, тож варіанти могли бути вже створені раніше
+    if all(backend.exists(k) for k in variant_keys(key)):
+        _set_status(event_id, field, key, 'ready')
+        return
+
+    started = time.monotonic()
+    work_dir = tempfile.mkdtemp(dir=backend.staging_dir())
+    source_path = backend.local_path(key)
+    if source_path is None:
+        source_path = os.path.join(work_dir, 'source')
+        backend.fetch(key, source_path)
+
+    if not _app.config['IMAGE_WORKERS']:
+        try:
+            _publish(key, render_variants(source_path, work_dir))
+        except Exception:
+            _app.logger.exception('Image processing failed for %s', key)
+            _set_status(event_id, field, key, 'failed')
+            metrics.observe('toloka_image_processing_seconds', time.monotonic() - started, status='failed')
+        else:
+            _set_status(event_id, field, key, 'ready')
+            metrics.observe('toloka_image_processing_seconds', time.monotonic() - started, status='ready')
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return
+    future = _get_pool().submit(render_variants, source_path, work_dir)
+    future.add_done_callback(partial(_finish, event_id, field, key, work_dir, started))
+
+
+def image_sources(key, status):
+    if status != 'ready':
+        return {'src': storage.media_url(key), 'srcset': '', 'webp_srcset': ''}
+
+    def srcset(ext):
+        return ', '.join(f'{storage.media_url(variant_key(key, variant, ext))} {width}w'
+                         for variant, width in VARIANTS.items())
+
+    return {
+        'src': storage.media_url(variant_key(key, 'card', 'jpg')),
+        'srcset': srcset('jpg'),
+        'webp_srcset': srcset('webp'),
+    }
@@ -0,0 +1,195 @@
+import json
+import os
+import signal
+import socket
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, delete, func, and_, or_
+from models import db, Job
+
+EPOCH = datetime(1970, 1, 1)
+
+HANDLERS = {}
+# (kind, інтервал у секундах) для завдань, які ставить сам воркер
+SCHEDULE = []
+
+_app = None
+
+
+def handler(kind, max_attempts=5):
+    def decorator(fn):
+        HANDLERS[kind] = (fn, max_attempts)
+        return fn
+    return decorator
+
+
+def periodic(kind, every, max_attempts=1):
+    def decorator(fn):
+        SCHEDULE.append((kind, every))
+        return handler(kind, max_attempts)(fn)
+    return decorator
+
+
+def init_app(app):
+    global _app
+    _app = app
+    app.config.setdefault('JOB_CONCURRENCY', 4)
+    app.config.setdefault('JOB_POLL_INTERVAL', 2)
+    app.config.setdefault('JOB_LEASE', 300)
+    app.config.setdefault('JOB_BACKOFF_BASE', 30)
+    app.config.setdefault('JOB_BACKOFF_MAX', 3600)
+    app.config.setdefault('JOB_RETENTION', timedelta(days=7))
+
+
+def _insert():
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(Job)
+
+
+def enqueue_many(kind, payloads, run_at=None, unique_keys=None):
+    # Пишеться в поточну транзакцію: завдання зʼявиться в черзі лише разом із комітом запиту
+    if not payloads:
+        return
+    rows = [{
+        'kind': kind,
+        'payload': json.dumps(payload),
+        'max_attempts': HANDLERS[kind][1],
+        'run_at': run_at or datetime.utcnow(),
+        'unique_key': unique_keys[i] if unique_keys else None,
+    } for i, payload in enumerate(payloads)]
+    if unique_keys:
+        db.session.execute(_insert().values(rows).on_conflict_do_nothing(index_elements=['unique_key']))
+    else:
+        db.session.execute(insert(Job), rows)
+
+
+def enqueue(kind, payload=None, run_at=None, unique_key=None):
+    enqueue_many(kind, [payload or {}], run_at=run_at, unique_keys=[unique_key] if unique_key else None)
+
+
+def schedule_due(now=None):
+    # Номер інтервалу в unique_key: кілька воркерів ставлять періодичне завдання лише один раз
+    now = now or datetime.utcnow()
+    seconds = int((now - EPOCH).total_seconds())
+    for kind, every in SCHEDULE:
+        enqueue(kind, run_at=now, unique_key=f'{kind}@{seconds // every}')
+    db.session.commit()
+
+
+def _due(now):
+    return or_(
+        and_(Job.status == 'queued', Job.run_at <= now),
+        # Воркер, що впав посеред завдання, не продовжив оренду — завдання повертається в роботу
+        and_(Job.status == 'running', Job.locked_until < now),
+    )
+
+
+def claim(worker_id, limit):
+    now = datetime.utcnow()
+    token = f'{worker_id}:{uuid.uuid4().hex[:12]}'
+    ids = db.session.execute(select(Job.id).where(_due(now)).order_by(Job.run_at).limit(limit)).scalars().all()
+    if not ids:
+        db.session.rollback()
+        return []
+    # Умова повторюється в UPDATE: рядок, уже взятий іншим воркером, просто не оновиться
+    db.session.execute(
+        update(Job)
+        .where(Job.id.in_(ids), _due(now))
+        .values(status='running', locked_by=token, attempts=Job.attempts + 1,
+                locked_until=now + timedelta(seconds=_app.config['JOB_LEASE']))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return db.session.execute(
+        select(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts, Job.locked_by)
+        .where(Job.locked_by == token)
+    ).all()
+
+
+def _finish(job, **values):
+    # Лише власник оренди змінює рядок: після її закінчення завдання могли передати іншому воркеру
+    db.session.execute(
+        update(Job)
+        .where(Job.id == job.id, Job.locked_by == job.locked_by, Job.status == 'running')
+        .values(locked_until=None, finished_at=datetime.utcnow() if values['status'] != 'queued' else None,
+                **values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def backoff(attempts):
+    return min(_app.config['JOB_BACKOFF_BASE'] * 2 ** (attempts - 1), _app.config['JOB_BACKOFF_MAX'])
+
+
+def run(job):
+    with _app.app_context():
+        fn = HANDLERS.get(job.kind, (None,))[0]
+        payload = json.loads(job.payload)
+        try:
+            if fn is None:
+                raise LookupError(f'Невідомий тип завдання {job.kind}')
+            fn(payload)
+            # Результат обробника і позначка done комітяться разом
+            _finish(job, status='done', last_error=None)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            error = traceback.format_exc()
+            _app.logger.error('Job %s %s failed (attempt %d/%d)\n%s',
+                              job.id, job.kind, job.attempts, job.max_attempts, error)
+            # Обробник може зменшити payload до ще не виконаної частини, тож повтор продовжує, а не починає заново
+            values = {'payload': json.dumps(payload), 'last_error': error[-4000:]}
+            if job.attempts >= job.max_attempts:
+                _finish(job, status='failed', **values)
+            else:
+                _finish(job, status='queued',
+                        run_at=datetime.utcnow() + timedelta(seconds=backoff(job.attempts)), **values)
+            db.session.commit()
+            return False
+        return True
+
+
+def work(concurrency=None, once=False, echo=print):
+    concurrency = concurrency or _app.config['JOB_CONCURRENCY']
+    poll = _app.config['JOB_POLL_INTERVAL']
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+
+    running = set()
+    last_schedule = 0.0
+    # Потоків не більше за concurrency: нові завдання беруться лише на вільні місця
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='job') as pool:
+        while not stopping:
+            with _app.app_context():
+                if time.monotonic() - last_schedule >= poll * 5:
+                    schedule_due()
+                    last_schedule = time.monotonic()
+                claimed = claim(worker_id, concurrency - len(running)) if len(running) < concurrency else []
+            for job in claimed:
+                echo(f'{job.kind} #{job.id} (спроба {job.attempts})')
+                running.add(pool.submit(run, job))
+            if once and not running:
+                break
+            if running:
+                _, running = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+            elif not claimed:
+                time.sleep(poll)
+        # Після SIGTERM нові завдання не беруться, розпочаті завершуються
+        wait(running)
+
+
+def purge(before):
+    result = db.session.execute(delete(Job).where(Job.status.in_(('done', 'failed')), Job.finished_at < before))
+    return result.rowcount
+
+
+def counts():
+    rows = db.session.execute(select(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status)).all()
+    return sorted(rows)
@@ -0,0 +1,155 @@
+import time
+from collections import Counter, defaultdict
+from threading import Lock
+from sqlalchemy import select, delete, func, tuple_
+from models import db, User, Team, RankNode
+import fragcache
+
+# Бали займають Integer, тож дерево покриває 1..2**31; нульові бали в ньому не зберігаються,
+# бо кількість записів з балами > p від них не залежить
+TREE_SIZE = 2 ** 31
+
+
+def _dialect_insert():
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(RankNode)
+
+
+def _walk_up(deltas, points, value):
+    node = points
+    while 0 < node <= TREE_SIZE:
+        deltas[node] += value
+        node += node & -node
+
+
+def _prefix_nodes(points):
+    nodes = []
+    node = min(points, TREE_SIZE)
+    while node > 0:
+        nodes.append(node)
+        node -= node & -node
+    return nodes
+
+
+def _add(board, deltas, execute, chunk=1000):
+    rows = [{'board': board, 'node': node, 'count': delta} for node, delta in sorted(deltas.items()) if delta]
+    # Пачки тримають кількість параметрів у межах лімітів SQLite і Postgres; вузли йдуть за зростанням,
+    # тож паралельні нарахування блокують рядки в однаковому порядку. Приріст комутативний
+    for start in range(0, len(rows), chunk):
+        statement = _dialect_insert().values(rows[start:start + chunk])
+        execute(statement.on_conflict_do_update(
+            index_elements=['board', 'node'], set_={'count': RankNode.count + statement.excluded.count}
+        ))
+
+
+def shift_points(board, new_points, delta):
+    # Викликається в транзакції нарахування з балами після UPDATE: кожен запис переходить з new - delta у new
+    if not delta:
+        return
+    deltas = defaultdict(int)
+    for points, count in Counter(points for points in new_points if points is not None).items():
+        _walk_up(deltas, points - delta, -count)
+        _walk_up(deltas, points, count)
+    _add(board, deltas, db.session.execute)
+
+
+def rebuild_tree(conn, model):
+    board = model.__tablename__
+    conn.execute(delete(RankNode).where(RankNode.board == board))
+    deltas = defaultdict(int)
+    for points, count in conn.execute(
+        select(model.points, func.count()).where(model.points > 0).group_by(model.points)
+    ):
+        _walk_up(deltas, points, count)
+    _add(board, deltas, conn.execute)
+
+
+class Leaderboard:
+    # Порядок (points DESC, id DESC) повністю покривається індексом (points, id),
+    # тому і сторінки, і підрахунок місця читаються з індексу без сортування таблиці.
+    def __init__(self, model, columns, page_size=50, ttl=60, tags=None):
+        self.model = model
+        self.columns = columns
+        self.page_size = page_size
+        self.ttl = ttl
+        self.tags = tags or (model.__tablename__,)
+        self._snapshot = None
+        self._snapshot_at = 0
+        self._snapshot_versions = None
+        self._lock = Lock()
+
+    def _query(self):
+        return select(*self.columns()).order_by(self.model.points.desc(), self.model.id.desc())
+
+    def page(self, after=None, limit=None):
+        limit = limit or self.page_size
+        query = self._query()
+        if after is not None:
+            query = query.where(tuple_(self.model.points, self.model.id) < tuple_(*after))
+        rows = db.session.execute(query.limit(limit + 1)).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].points, rows[-1].id)
+        return rows, next_cursor
+
+    def top(self):
+        # Знімок скидається, щойно комміт змінює таблиці з self.tags (див. fragcache)
+        versions = fragcache.versions(self.tags)
+        with self._lock:
+            if self._snapshot is None or versions != self._snapshot_versions \
+                    or time.monotonic() - self._snapshot_at > self.ttl:
+                self._snapshot = self.page()
+                self._snapshot_at = time.monotonic()
+                self._snapshot_versions = versions
+            return self._snapshot
+
+    def count_above(self, points):
+        # Сума не більше ніж 32 вузлів дерева за первинним ключем замість COUNT по всіх вищих записах
+        prefix = _prefix_nodes(points or 0)
+        counts = dict(db.session.execute(
+            select(RankNode.node, RankNode.count)
+            .where(RankNode.board == self.model.__tablename__, RankNode.node.in_(prefix + [TREE_SIZE]))
+        ).all())
+        return counts.get(TREE_SIZE, 0) - sum(counts.get(node, 0) for node in prefix)
+
+    def rank(self, points):
+        return self.count_above(points) + 1
+
+    def position(self, points, entity_id):
+        # Рівні бали впорядковані за id; їх читає діапазон індексу (points, id)
+        ties = db.session.execute(
+            select(func.count()).select_from(self.model)
+            .where(self.model.points == points, self.model.id > entity_id)
+        ).scalar()
+        return self.count_above(points) + ties
+
+
+def encode_cursor(points, entity_id):
+    return f'{points}:{entity_id}'
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        points, entity_id = cursor.split(':', 1)
+        return int(points), int(entity_id)
+    except ValueError:
+        return None
+
+
+def _user_columns():
+    return (User.id, User.username, User.points, User.events_count, User.total_waste)
+
+
+def _team_columns():
+    return (Team.id, Team.name, Team.description, Team.league, Team.points, Team.events_count,
+            Team.members_count.label('members_count'))
+
+
+users_board = Leaderboard(User, _user_columns)
+teams_board = Leaderboard(Team, _team_columns, page_size=24, tags=('team', 'team_members'))
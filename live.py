@@ -0,0 +1,205 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from threading import Lock, Thread, Event as Signal
+from flask import Response
+from sqlalchemy import select
+from models import db, Event
+from stats import get_stats, stats_dict
+
+EVENT_COLUMNS = (Event.id, Event.status, Event.participants_count, Event.max_participants,
+                 Event.waste_collected, Event.area_cleaned)
+
+_app = None
+_hub = None
+_ticker_pid = None
+
+
+class Subscriber:
+    # Для кожного каналу тримається лише останнє повідомлення: повільний клієнт не накопичує черги
+    __slots__ = ('channels', 'pending', 'signal')
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.pending = {}
+        self.signal = Signal()
+
+    def push(self, channel, message):
+        self.pending[channel] = message
+        self.signal.set()
+
+    def wait(self, timeout):
+        if not self.signal.wait(timeout):
+            return []
+        self.signal.clear()
+        pending, self.pending = self.pending, {}
+        return list(pending.values())
+
+
+class Hub:
+    def __init__(self, max_subscribers):
+        self.max_subscribers = max_subscribers
+        self.count = 0
+        self._channels = {}
+        # Останній стан каналу: знімок для нових підписників і відсіювання повторів
+        self._last = {}
+        self._lock = Lock()
+
+    def subscribe(self, channels):
+        with self._lock:
+            if self.count >= self.max_subscribers:
+                return None
+            subscriber = Subscriber(channels)
+            for channel in channels:
+                self._channels.setdefault(channel, set()).add(subscriber)
+            self.count += 1
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            for channel in subscriber.channels:
+                listeners = self._channels.get(channel)
+                if listeners is None:
+                    continue
+                listeners.discard(subscriber)
+                if not listeners:
+                    # Стан зберігається лише для каналів зі слухачами, тож памʼять обмежена їх кількістю
+                    del self._channels[channel]
+                    self._last.pop(channel, None)
+            self.count -= 1
+
+    def channels(self):
+        with self._lock:
+            return list(self._channels)
+
+    def last(self, channel):
+        return self._last.get(channel)
+
+    def publish(self, channel, message):
+        with self._lock:
+            if self._last.get(channel) == message:
+                return
+            self._last[channel] = message
+            listeners = list(self._channels.get(channel, ()))
+        for subscriber in listeners:
+            subscriber.push(channel, message)
+
+
+def init_app(app):
+    global _app, _hub
+    _app = app
+    app.config.setdefault('LIVE_ENABLED', False)
+    app.config.setdefault('LIVE_URL', None)
+    app.config.setdefault('LIVE_TICK', 1.0)
+    app.config.setdefault('LIVE_OVERLAP', 5)
+    app.config.setdefault('LIVE_HEARTBEAT', 15)
+    app.config.setdefault('LIVE_MAX_SUBSCRIBERS', 10000)
+    _hub = Hub(app.config['LIVE_MAX_SUBSCRIBERS'])
+    app.jinja_env.globals['live_url'] = live_url
+
+
+def live_url(path):
+    base = _app.config['LIVE_URL']
+    return None if base is None else f'{base.rstrip("/")}/live/{path}'
+
+
+def _stats_message(row):
+    return 'stats', json.dumps(dict(stats_dict(row), version=row.version))
+
+
+def _event_message(row):
+    return 'event', json.dumps({
+        'id': row.id, 'status': row.status, 'participants_count': row.participants_count,
+        'max_participants': row.max_participants, 'waste_collected': row.waste_collected,
+        'area_cleaned': row.area_cleaned,
+    })
+
+
+def _snapshot(channel):
+    if channel == 'stats':
+        return _stats_message(get_stats())
+    row = db.session.execute(select(*EVENT_COLUMNS).where(Event.id == int(channel.split(':', 1)[1]))).first()
+    return _event_message(row) if row else None
+
+
+def poll(since):
+    # Один запит на тік на процес незалежно від кількості зʼєднань; зміни за тік зливаються в одне повідомлення
+    started = datetime.utcnow()
+    channels = _hub.channels()
+    if 'stats' in channels:
+        _hub.publish('stats', _stats_message(get_stats()))
+    event_ids = {int(channel.split(':', 1)[1]) for channel in channels if channel.startswith('event:')}
+    if event_ids:
+        # join/leave/complete оновлюють updated_at; перекриття ловить транзакції, що комітнулись пізніше
+        for row in db.session.execute(
+            select(*EVENT_COLUMNS).where(Event.updated_at >= since, Event.id.in_(event_ids))
+        ):
+            _hub.publish(f'event:{row.id}', _event_message(row))
+    return started - timedelta(seconds=_app.config['LIVE_OVERLAP'])
+
+
+def _tick():
+    since = datetime.utcnow() - timedelta(seconds=_app.config['LIVE_OVERLAP'])
+    while True:
+        time.sleep(_app.config['LIVE_TICK'])
+        if not _hub.count:
+            continue
+        try:
+            with _app.app_context():
+                since = poll(since)
+        except Exception:
+            _app.logger.exception('Live poll failed')
+
+
+def _ensure_ticker():
+    global _ticker_pid
+    # Потік створюється ліниво в кожному воркері після fork; під gevent це гринлет
+    if _ticker_pid != os.getpid():
+        _ticker_pid = os.getpid()
+        Thread(target=_tick, name='live-tick', daemon=True).start()
+
+
+def _format(message):
+    name, data = message
+    return f'event: {name}\ndata: {data}\n\n'
+
+
+def _stream(subscriber):
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            messages = subscriber.wait(_app.config['LIVE_HEARTBEAT'])
+            if not messages:
+                yield ': ping\n\n'
+            for message in messages:
+                yield _format(message)
+    finally:
+        _hub.unsubscribe(subscriber)
+
+
+def response(channels):
+    if not _app.config['LIVE_ENABLED']:
+        return None
+    subscriber = _hub.subscribe(channels)
+    if subscriber is None:
+        return Response('Забагато зʼєднань', 503, {'Retry-After': '10'})
+    # Перше повідомлення — поточний стан, тож після перепідключення клієнт нічого не пропускає
+    for channel in channels:
+        message = _hub.last(channel)
+        if message is not None:
+            subscriber.push(channel, message)
+            continue
+        message = _snapshot(channel)
+        if message is None:
+            _hub.unsubscribe(subscriber)
+            return None
+        _hub.publish(channel, message)
+
+    _ensure_ticker()
+    # Без stream_with_context: зʼєднання не тримає ні контексту застосунку, ні сесії бази
+    return Response(_stream(subscriber), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        'Access-Control-Allow-Origin': '*',
+    })
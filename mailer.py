@@ -0,0 +1,101 @@
+import os
+import smtplib
+import socketserver
+import time
+import uuid
+from email.message import EmailMessage
+from threading import BoundedSemaphore
+
+_app = None
+_slots = None
+
+
+def init_app(app):
+    global _app, _slots
+    _app = app
+    app.config.setdefault('MAIL_SERVER', 'localhost')
+    app.config.setdefault('MAIL_PORT', 1025)
+    app.config.setdefault('MAIL_USE_TLS', False)
+    app.config.setdefault('MAIL_USERNAME', None)
+    app.config.setdefault('MAIL_PASSWORD', None)
+    app.config.setdefault('MAIL_SENDER', 'Толока <noreply@toloka.local>')
+    app.config.setdefault('MAIL_MAX_CONNECTIONS', 2)
+    app.config.setdefault('MAIL_TIMEOUT', 10)
+    _slots = BoundedSemaphore(app.config['MAIL_MAX_CONNECTIONS'])
+
+
+def message(to, subject, body):
+    msg = EmailMessage()
+    msg['From'] = _app.config['MAIL_SENDER']
+    msg['To'] = to
+    msg['Subject'] = subject
+    msg.set_content(body)
+    return msg
+
+
+def send(messages, on_sent=None):
+    # Одне зʼєднання на пачку; одночасних зʼєднань у процесі не більше MAIL_MAX_CONNECTIONS
+    config = _app.config
+    with _slots:
+        with smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=config['MAIL_TIMEOUT']) as smtp:
+            if config['MAIL_USE_TLS']:
+                smtp.starttls()
+            if config['MAIL_USERNAME']:
+                smtp.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+            sent = 0
+            for key, msg in messages:
+                try:
+                    smtp.send_message(msg)
+                except smtplib.SMTPRecipientsRefused:
+                    # Повтор не допоможе адресі, яку сервер відхилив
+                    _app.logger.warning('Recipient refused: %s', msg['To'])
+                else:
+                    sent += 1
+                if on_sent:
+                    on_sent(key)
+    return sent
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    # Мінімальний SMTP для розробки: кожен лист зберігається як .eml у каталозі сервера
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.reply('220 toloka mail sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip().upper()
+            if command.startswith(('HELO', 'EHLO')):
+                self.reply('250 toloka')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data in iter(self.rfile.readline, b''):
+                    if data in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data[1:] if data.startswith(b'..') else data)
+                path = os.path.join(self.server.directory, f'{time.time_ns()}-{uuid.uuid4().hex[:8]}.eml')
+                with open(path, 'wb') as f:
+                    f.writelines(lines)
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                # MAIL FROM, RCPT TO, RSET, NOOP
+                self.reply('250 OK')
+
+
+class _SinkServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def sink(host, port, directory):
+    os.makedirs(directory, exist_ok=True)
+    server = _SinkServer((host, port), _SinkHandler)
+    server.directory = directory
+    return server
@@ -0,0 +1,208 @@
+import atexit
+import glob
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from threading import Lock
+from flask import g, request, has_request_context, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Межі в одиницях самої метрики: кількість запитів на сторінку, а не секунди
+METRIC_BUCKETS = {
+    'toloka_sql_queries_per_request': (1, 2, 5, 10, 20, 50, 100, 200),
+}
+HELP = {
+    'toloka_request_duration_seconds': 'HTTP request latency by route',
+    'toloka_sql_queries_per_request': 'SQL statements executed per request',
+    'toloka_sql_duration_seconds': 'Total SQL time per request',
+    'toloka_template_render_seconds': 'Jinja template render time',
+    'toloka_upload_seconds': 'Time to hash and store an upload',
+    'toloka_image_processing_seconds': 'Time to render image variants',
+}
+
+enabled = False
+_app = None
+_lock = Lock()
+_histograms = {}
+_last_flush = 0.0
+
+
+def buckets(name):
+    return METRIC_BUCKETS.get(name, BUCKETS)
+
+
+def observe(name, value, **labels):
+    if not enabled:
+        return
+    key = json.dumps(sorted(labels.items()))
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        values = series.get(key)
+        bounds = buckets(name)
+        if values is None:
+            values = series[key] = [0] * (len(bounds) + 2)
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                values[i] += 1
+                break
+        values[-2] += value
+        values[-1] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    if not enabled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context():
+        g.setdefault('sql_queries', []).append((statement, duration))
+
+
+def _before_render(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('render_starts', []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    if has_request_context() and g.get('render_starts'):
+        observe('toloka_template_render_seconds', time.perf_counter() - g.render_starts.pop(),
+                template=template.name or 'string')
+
+
+def _snapshot_path(pid=None):
+    return os.path.join(_app.config['METRICS_DIR'], f'{pid or os.getpid()}.json')
+
+
+def flush():
+    # Кожен процес gunicorn пише свій знімок; /metrics підсумовує всі файли
+    with _lock:
+        data = json.dumps(_histograms)
+    path = _snapshot_path()
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def _maybe_flush():
+    global _last_flush
+    now = time.monotonic()
+    if now - _last_flush >= _app.config['METRICS_FLUSH_INTERVAL']:
+        _last_flush = now
+        flush()
+
+
+def collect():
+    flush()
+    merged = {}
+    for path in glob.glob(os.path.join(_app.config['METRICS_DIR'], '*.json')):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, series in snapshot.items():
+            target = merged.setdefault(name, {})
+            for key, values in series.items():
+                if len(values) != len(buckets(name)) + 2:
+                    # Знімок процесу зі старими межами не складається з новими
+                    continue
+                current = target.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    current[i] += value
+    return merged
+
+
+def _labels(pairs):
+    return ','.join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                    for k, v in pairs)
+
+
+def render_prometheus(merged):
+    lines = []
+    for name in sorted(merged):
+        lines.append(f'# HELP {name} {HELP.get(name, name)}')
+        lines.append(f'# TYPE {name} histogram')
+        for key, values in sorted(merged[name].items()):
+            pairs = [tuple(pair) for pair in json.loads(key)]
+            cumulative = 0
+            for bound, count in zip(buckets(name), values):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{_labels(pairs + [("le", bound)])}}} {cumulative}')
+            lines.append(f'{name}_bucket{{{_labels(pairs + [("le", "+Inf")])}}} {values[-1]}')
+            lines.append(f'{name}_sum{{{_labels(pairs)}}} {values[-2]}')
+            lines.append(f'{name}_count{{{_labels(pairs)}}} {values[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    global enabled, _app
+    _app = app
+    app.config.setdefault('METRICS_ENABLED', False)
+    app.config.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'toloka-metrics'))
+    app.config.setdefault('METRICS_FLUSH_INTERVAL', 5)
+    app.config.setdefault('METRICS_TOKEN', None)
+    app.config.setdefault('SLOW_REQUEST_MS', 500)
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    # Без METRICS_ENABLED жоден обробник не реєструється, тож вимкнені метрики нічого не коштують
+    enabled = True
+    os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    atexit.register(flush)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+        route = _route()
+        queries = g.get('sql_queries', [])
+        observe('toloka_request_duration_seconds', duration,
+                route=route, method=request.method, status=response.status_code)
+        observe('toloka_sql_queries_per_request', len(queries), route=route)
+        observe('toloka_sql_duration_seconds', sum(d for _, d in queries), route=route)
+
+        if duration * 1000 >= app.config['SLOW_REQUEST_MS']:
+            details = '\n'.join(f'  {d * 1000:7.1f} ms  {" ".join(s.split())[:300]}' for s, d in queries)
+            app.logger.warning('Slow request %s %s: %.0f ms, %d queries\n%s',
+                               request.method, request.path, duration * 1000, len(queries), details)
+        _maybe_flush()
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        token = app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return 'Unauthorized', 401
+        return render_prometheus(collect()), 200, {'Content-Type': 'text/plain; version=0.0.4'}
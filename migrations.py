@@ -0,0 +1,334 @@
+from datetime import datetime
+from sqlalchemy import Table, Column, Integer, String, Text, Float, DateTime, ForeignKey, MetaData, \
+    PrimaryKeyConstraint, select, insert, update, delete, func, inspect, text, bindparam, table, column
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Team
+from achievements import CATALOG
+import rollups
+import leaderboard
+import geo
+
+# Окрема метадата: таблиця версій не є моделлю і не створюється через db.create_all
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+# Схема бази до першої міграції (db.create_all початкових моделей): з неї оновлюються розгорнуті бази
+baseline = MetaData()
+Table('user', baseline,
+      Column('id', Integer, primary_key=True), Column('username', String(80), nullable=False, unique=True),
+      Column('email', String(120), nullable=False, unique=True), Column('password_hash', String(200), nullable=False),
+      Column('full_name', String(120)), Column('avatar', String(200)), Column('points', Integer),
+      Column('events_count', Integer), Column('total_waste', Float), Column('total_area', Float),
+      Column('created_at', DateTime))
+Table('team', baseline,
+      Column('id', Integer, primary_key=True), Column('name', String(100), nullable=False, unique=True),
+      Column('description', Text), Column('logo', String(200)), Column('points', Integer),
+      Column('events_count', Integer), Column('league', String(20)),
+      Column('captain_id', Integer, ForeignKey('user.id')), Column('created_at', DateTime))
+Table('event', baseline,
+      Column('id', Integer, primary_key=True), Column('title', String(200), nullable=False),
+      Column('description', Text), Column('location', String(200), nullable=False), Column('latitude', Float),
+      Column('longitude', Float), Column('date', DateTime, nullable=False), Column('duration', Integer),
+      Column('max_participants', Integer), Column('image_before', String(200)), Column('image_after', String(200)),
+      Column('waste_collected', Float), Column('area_cleaned', Float), Column('status', String(20)),
+      Column('creator_id', Integer, ForeignKey('user.id'), nullable=False),
+      Column('team_id', Integer, ForeignKey('team.id')), Column('created_at', DateTime))
+Table('polluted_place', baseline,
+      Column('id', Integer, primary_key=True), Column('title', String(200), nullable=False),
+      Column('description', Text), Column('latitude', Float, nullable=False), Column('longitude', Float, nullable=False),
+      Column('severity', String(20)), Column('photo', String(200)),
+      Column('reporter_id', Integer, ForeignKey('user.id')), Column('status', String(20)),
+      Column('created_at', DateTime))
+Table('achievement', baseline,
+      Column('id', Integer, primary_key=True), Column('name', String(100), nullable=False),
+      Column('description', Text), Column('icon', String(50)), Column('condition_type', String(50)),
+      Column('condition_value', Integer))
+Table('user_achievement', baseline,
+      Column('id', Integer, primary_key=True), Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+      Column('achievement_id', Integer, ForeignKey('achievement.id'), nullable=False),
+      Column('earned_at', DateTime))
+Table('team_members', baseline,
+      Column('user_id', Integer, ForeignKey('user.id')), Column('team_id', Integer, ForeignKey('team.id')),
+      Column('joined_at', DateTime), PrimaryKeyConstraint('user_id', 'team_id'))
+Table('event_participants', baseline,
+      Column('user_id', Integer, ForeignKey('user.id')), Column('event_id', Integer, ForeignKey('event.id')),
+      Column('joined_at', DateTime), PrimaryKeyConstraint('user_id', 'event_id'))
+
+MIGRATIONS = []
+
+
+class _AlreadyApplied(Exception):
+    pass
+
+
+def migration(version, name):
+    def decorator(fn):
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return decorator
+
+
+def _quote(conn, name):
+    return conn.dialect.identifier_preparer.quote(name)
+
+
+def _columns(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+
+def add_column(conn, table, name, default=None):
+    # Тип береться з моделі; кожен крок можна безпечно повторити
+    if name in _columns(conn, table):
+        return False
+    column = db.metadata.tables[table].c[name]
+    ddl = f'ALTER TABLE {_quote(conn, table)} ADD COLUMN {_quote(conn, name)} {column.type.compile(conn.dialect)}'
+    if default is not None:
+        ddl += f' DEFAULT {default}'
+    if not column.nullable and default is not None:
+        ddl += ' NOT NULL'
+    conn.execute(text(ddl))
+    return True
+
+
+def create_index(conn, name, table, columns, unique=False):
+    # CREATE INDEX IF NOT EXISTS підтримують і SQLite, і Postgres
+    conn.execute(text(
+        f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS {_quote(conn, name)} '
+        f'ON {_quote(conn, table)} ({", ".join(_quote(conn, column) for column in columns)})'
+    ))
+
+
+def bare_table(name, *columns):
+    # Лише названі колонки, без моделі: у запит не потрапляють onupdate і колонки, яких у базі ще немає
+    return table(name, *(column(column_name) for column_name in columns))
+
+
+def backfill_geohash(conn, table_name, chunk=1000):
+    table = bare_table(table_name, 'id', 'latitude', 'longitude', 'geohash')
+    statement = update(table).where(table.c.id == bindparam('_id')).values(geohash=bindparam('_geohash'))
+    updated = 0
+    while True:
+        rows = conn.execute(
+            select(table.c.id, table.c.latitude, table.c.longitude)
+            .where(table.c.geohash.is_(None), table.c.latitude.isnot(None), table.c.longitude.isnot(None))
+            .limit(chunk)
+        ).all()
+        if not rows:
+            return updated
+        conn.execute(statement, [
+            {'_id': row.id, '_geohash': geo.encode(row.latitude, row.longitude)} for row in rows
+        ])
+        updated += len(rows)
+
+
+def seed_achievements(conn):
+    table = db.metadata.tables['achievement']
+    if conn.dialect.name in ('sqlite', 'postgresql'):
+        if conn.dialect.name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        conn.execute(dialect_insert(table).values(CATALOG).on_conflict_do_nothing(index_elements=['name']))
+        return
+    existing = set(conn.execute(select(table.c.name)).scalars())
+    missing = [row for row in CATALOG if row['name'] not in existing]
+    if missing:
+        conn.execute(insert(table), missing)
+
+
+@migration(1, 'create_tables')
+def create_tables(conn):
+    # Нова база одразу отримує актуальну схему; наявні таблиці не змінюються
+    db.metadata.create_all(conn)
+
+
+@migration(2, 'event_columns')
+def event_columns(conn):
+    add_column(conn, 'event', 'geohash')
+    add_column(conn, 'event', 'image_before_status')
+    add_column(conn, 'event', 'image_after_status')
+    add_column(conn, 'event', 'updated_at')
+    add_column(conn, 'event', 'participants_count', default=0)
+    event = bare_table('event', 'id', 'participants_count', 'updated_at', 'created_at')
+    participants = bare_table('event_participants', 'event_id')
+    conn.execute(update(event).values(participants_count=(
+        select(func.count()).select_from(participants)
+        .where(participants.c.event_id == event.c.id)
+        .scalar_subquery()
+    )))
+    conn.execute(update(event).where(event.c.updated_at.is_(None)).values(updated_at=event.c.created_at))
+    backfill_geohash(conn, 'event')
+
+
+@migration(3, 'polluted_place_geohash')
+def polluted_place_geohash(conn):
+    add_column(conn, 'polluted_place', 'geohash')
+    backfill_geohash(conn, 'polluted_place')
+
+
+@migration(4, 'indexes')
+def indexes(conn):
+    create_index(conn, 'ix_event_date', 'event', ['date'])
+    create_index(conn, 'ix_event_status_date', 'event', ['status', 'date'])
+    create_index(conn, 'ix_event_creator_id', 'event', ['creator_id'])
+    create_index(conn, 'ix_event_team_id', 'event', ['team_id'])
+    create_index(conn, 'ix_event_geohash', 'event', ['geohash'])
+    create_index(conn, 'ix_user_points_id', 'user', ['points', 'id'])
+    create_index(conn, 'ix_team_points_id', 'team', ['points', 'id'])
+    create_index(conn, 'ix_polluted_place_status', 'polluted_place', ['status'])
+    create_index(conn, 'ix_polluted_place_geohash', 'polluted_place', ['geohash'])
+    # Первинні ключі таблиць звʼязку починаються з user_id; зворотні індекси покривають пошук з іншого боку
+    create_index(conn, 'ix_event_participants_event_id', 'event_participants', ['event_id', 'joined_at'])
+    create_index(conn, 'ix_event_participants_user_id', 'event_participants', ['user_id', 'joined_at'])
+    create_index(conn, 'ix_team_members_team_id', 'team_members', ['team_id'])
+    create_index(conn, 'ix_event_waitlist_event_id', 'event_waitlist', ['event_id', 'created_at'])
+
+
+@migration(5, 'unique_achievements')
+def unique_achievements(conn):
+    achievement = db.metadata.tables['achievement']
+    user_achievement = db.metadata.tables['user_achievement']
+    # Унікальні індекси не створяться поверх дублікатів, тому лишається найстаріший рядок
+    keep = select(func.min(user_achievement.c.id)).group_by(user_achievement.c.user_id,
+                                                             user_achievement.c.achievement_id)
+    conn.execute(delete(user_achievement).where(user_achievement.c.id.not_in(keep)))
+    create_index(conn, 'uq_user_achievement', 'user_achievement', ['user_id', 'achievement_id'], unique=True)
+    keep = select(func.min(achievement.c.id)).group_by(achievement.c.name)
+    conn.execute(delete(user_achievement).where(user_achievement.c.achievement_id.not_in(keep)))
+    conn.execute(delete(achievement).where(achievement.c.id.not_in(keep)))
+    create_index(conn, 'uq_achievement_name', 'achievement', ['name'], unique=True)
+
+
+@migration(6, 'seed_achievements')
+def seed_achievements_migration(conn):
+    seed_achievements(conn)
+
+
+@migration(7, 'spatial_status_indexes')
+def spatial_status_indexes(conn):
+    # Окремий індекс за статусом планувальник обирав замість діапазонів geohash
+    create_index(conn, 'ix_polluted_place_status_geohash', 'polluted_place', ['status', 'geohash'])
+    create_index(conn, 'ix_event_status_geohash', 'event', ['status', 'geohash'])
+    conn.execute(text(f'DROP INDEX IF EXISTS {_quote(conn, "ix_polluted_place_status")}'))
+
+
+@migration(8, 'impact_rollups')
+def impact_rollups(conn):
+    db.metadata.tables['impact_rollup'].create(conn, checkfirst=True)
+    create_index(conn, 'ix_impact_rollup_breakdown', 'impact_rollup', ['period', 'scope', 'period_start'])
+    rollups.rebuild(conn)
+
+
+@migration(9, 'updated_at_columns')
+def updated_at_columns(conn):
+    # updated_at потрібен інкрементальному експорту (exports.py, параметр updated_since)
+    for table_name in ('user', 'polluted_place'):
+        add_column(conn, table_name, 'updated_at')
+        table = bare_table(table_name, 'updated_at', 'created_at')
+        conn.execute(update(table).where(table.c.updated_at.is_(None)).values(updated_at=table.c.created_at))
+    create_index(conn, 'ix_user_updated_at', 'user', ['updated_at'])
+    create_index(conn, 'ix_polluted_place_updated_at', 'polluted_place', ['updated_at'])
+    create_index(conn, 'ix_event_updated_at', 'event', ['updated_at'])
+
+
+@migration(10, 'jobs')
+def jobs_table(conn):
+    # create_all створює лише відсутні таблиці разом з їхніми індексами
+    db.metadata.create_all(conn, tables=[db.metadata.tables['job']])
+
+
+@migration(11, 'rank_tree')
+def rank_tree(conn):
+    db.metadata.create_all(conn, tables=[db.metadata.tables['rank_node']])
+    for model in (User, Team):
+        leaderboard.rebuild_tree(conn, model)
+
+
+def applied_versions(engine):
+    schema_version.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return set(conn.execute(select(schema_version.c.version)).scalars())
+
+
+def pending(engine):
+    applied = applied_versions(engine)
+    return [(version, name, fn) for version, name, fn in sorted(MIGRATIONS) if version not in applied]
+
+
+def upgrade(engine, echo=print):
+    # Кожна міграція — окрема транзакція разом із записом її версії
+    applied = []
+    for version, name, fn in pending(engine):
+        try:
+            with engine.begin() as conn:
+                fn(conn)
+                try:
+                    conn.execute(insert(schema_version).values(version=version, name=name,
+                                                               applied_at=datetime.utcnow()))
+                except IntegrityError:
+                    raise _AlreadyApplied()
+        except _AlreadyApplied:
+            # Ту саму міграцію щойно застосував інший процес релізу; її транзакція відкочена
+            echo(f'{version:04d} {name}: вже застосована')
+            continue
+        echo(f'{version:04d} {name}')
+        applied.append(version)
+    return applied
+
+
+def check_upgrade(engine, echo=print):
+    # Порожня база отримує початкову схему з рядками, які зачіпають міграції, і проходить upgrade двічі
+    baseline.create_all(engine)
+    created = datetime(2025, 1, 1)
+    with engine.begin() as conn:
+        rows = {
+            'user': [{'id': 1, 'username': 'u1', 'email': 'u1@example.com', 'password_hash': '-', 'points': 50,
+                      'events_count': 1, 'total_waste': 1.0, 'total_area': 1.0, 'created_at': created}],
+            'team': [{'id': 1, 'name': 't1', 'points': 50, 'events_count': 1, 'captain_id': 1,
+                      'created_at': created}],
+            'event': [{'id': 1, 'title': 'e1', 'location': 'Київ', 'latitude': 50.45, 'longitude': 30.52,
+                       'date': created, 'status': 'completed', 'creator_id': 1, 'team_id': 1,
+                       'waste_collected': 1.0, 'area_cleaned': 1.0, 'created_at': created}],
+            'polluted_place': [{'id': 1, 'title': 'p1', 'latitude': 50.45, 'longitude': 30.52, 'status': 'active',
+                                'reporter_id': 1, 'created_at': created}],
+            'achievement': [{'id': 1, 'name': 'a1'}, {'id': 2, 'name': 'a1'}],
+            'user_achievement': [{'id': 1, 'user_id': 1, 'achievement_id': 1, 'earned_at': created},
+                                 {'id': 2, 'user_id': 1, 'achievement_id': 2, 'earned_at': created}],
+            'team_members': [{'user_id': 1, 'team_id': 1, 'joined_at': created}],
+            'event_participants': [{'user_id': 1, 'event_id': 1, 'joined_at': created}],
+        }
+        for table_name, values in rows.items():
+            conn.execute(insert(baseline.tables[table_name]), values)
+
+    upgrade(engine, echo)
+    problems = []
+    if upgrade(engine, echo):
+        problems.append('повторний upgrade застосував міграції')
+    inspector = inspect(engine)
+    for table_name, model_table in db.metadata.tables.items():
+        if not inspector.has_table(table_name):
+            problems.append(f'немає таблиці {table_name}')
+            continue
+        missing = set(model_table.c.keys()) - {column['name'] for column in inspector.get_columns(table_name)}
+        if missing:
+            problems.append(f'{table_name}: немає колонок {", ".join(sorted(missing))}')
+    if problems:
+        return problems
+
+    # Заповнення колонок, доданих міграціями, для рядків, що існували до них
+    event = db.metadata.tables['event']
+    place = db.metadata.tables['polluted_place']
+    with engine.connect() as conn:
+        row = conn.execute(select(event.c.participants_count, event.c.geohash, event.c.updated_at)).one()
+        if row.participants_count != 1 or row.geohash is None or row.updated_at != created:
+            problems.append(f'event: {tuple(row)}')
+        row = conn.execute(select(place.c.geohash, place.c.updated_at)).one()
+        if row.geohash is None or row.updated_at != created:
+            problems.append(f'polluted_place: {tuple(row)}')
+        if conn.execute(select(func.count()).select_from(db.metadata.tables['user_achievement'])).scalar() != 1:
+            problems.append('user_achievement: дублікати не обʼєднані')
+    return problems
@@ -1,7 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import select, func
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+import geo
 
 db = SQLAlchemy()
 
@@ -9,14 +11,25 @@ db = SQLAlchemy()
 event_participants = db.Table('event_participants',
                               db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
                               db.Column('event_id', db.Integer, db.ForeignKey('event.id'), primary_key=True),
-                              db.Column('joined_at', db.DateTime, default=datetime.utcnow)
+                              db.Column('joined_at', db.DateTime, default=datetime.utcnow),
+                              db.Index('ix_event_participants_event_id', 'event_id', 'joined_at'),
+                              db.Index('ix_event_participants_user_id', 'user_id', 'joined_at')
                               )
 
+# Черга очікування на події без вільних місць
+event_waitlist = db.Table('event_waitlist',
+                          db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+                          db.Column('event_id', db.Integer, db.ForeignKey('event.id'), primary_key=True),
+                          db.Column('created_at', db.DateTime, default=datetime.utcnow),
+                          db.Index('ix_event_waitlist_event_id', 'event_id', 'created_at')
+                          )
+
 # Таблиця зв'язку членів команди
 team_members = db.Table('team_members',
                         db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
                         db.Column('team_id', db.Integer, db.ForeignKey('team.id'), primary_key=True),
-                        db.Column('joined_at', db.DateTime, default=datetime.utcnow)
+                        db.Column('joined_at', db.DateTime, default=datetime.utcnow),
+                        db.Index('ix_team_members_team_id', 'team_id')
                         )
 
 
@@ -24,7 +37,8 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(200), nullable=False)
+    # Потрібен лише під час входу; звичайні завантаження User його не читають
+    password_hash = db.deferred(db.Column(db.String(200), nullable=False))
     full_name = db.Column(db.String(120))
     avatar = db.Column(db.String(200), default='default.png')
     points = db.Column(db.Integer, default=0)
@@ -32,6 +46,12 @@ class User(UserMixin, db.Model):
     total_waste = db.Column(db.Float, default=0.0)
     total_area = db.Column(db.Float, default=0.0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_user_points_id', 'points', 'id'),
+        db.Index('ix_user_updated_at', 'updated_at'),
+    )
 
     created_events = db.relationship('Event', backref='creator', lazy=True, foreign_keys='Event.creator_id')
     participated_events = db.relationship('Event', secondary=event_participants, backref='participants')
@@ -52,17 +72,34 @@ class Event(db.Model):
     location = db.Column(db.String(200), nullable=False)
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12), index=True)
     date = db.Column(db.DateTime, nullable=False)
     duration = db.Column(db.Integer)
     max_participants = db.Column(db.Integer)
     image_before = db.Column(db.String(200))
+    image_before_status = db.Column(db.String(10))
     image_after = db.Column(db.String(200))
+    image_after_status = db.Column(db.String(10))
     waste_collected = db.Column(db.Float, default=0.0)
     area_cleaned = db.Column(db.Float, default=0.0)
     status = db.Column(db.String(20), default='planned')
     creator_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     team_id = db.Column(db.Integer, db.ForeignKey('team.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Ті самі імена індексів створює migrations.py для вже наявних баз
+    __table_args__ = (
+        db.Index('ix_event_status_date', 'status', 'date'),
+        db.Index('ix_event_date', 'date'),
+        db.Index('ix_event_creator_id', 'creator_id'),
+        db.Index('ix_event_team_id', 'team_id'),
+        db.Index('ix_event_status_geohash', 'status', 'geohash'),
+        db.Index('ix_event_updated_at', 'updated_at'),
+    )
+
+    # Підтримується атомарно в registration.py разом з event_participants
+    participants_count = db.Column(db.Integer, default=0, nullable=False)
 
 
 class Team(db.Model):
@@ -76,6 +113,15 @@ class Team(db.Model):
     captain_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (db.Index('ix_team_points_id', 'points', 'id'),)
+
+    members_count = db.column_property(
+        select(func.count()).select_from(team_members)
+        .where(team_members.c.team_id == id)
+        .correlate_except(team_members)
+        .scalar_subquery()
+    )
+
     events = db.relationship('Event', backref='team', lazy=True)
 
 
@@ -87,6 +133,8 @@ class Achievement(db.Model):
     condition_type = db.Column(db.String(50))
     condition_value = db.Column(db.Integer)
 
+    __table_args__ = (db.Index('uq_achievement_name', 'name', unique=True),)
+
 
 class UserAchievement(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -94,7 +142,9 @@ class UserAchievement(db.Model):
     achievement_id = db.Column(db.Integer, db.ForeignKey('achievement.id'), nullable=False)
     earned_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    achievement = db.relationship('Achievement', backref='user_achievements')
+    __table_args__ = (db.Index('uq_user_achievement', 'user_id', 'achievement_id', unique=True),)
+
+    achievement = db.relationship('Achievement', backref='user_achievements', lazy='joined')
 
 
 class PollutedPlace(db.Model):
@@ -103,8 +153,88 @@ class PollutedPlace(db.Model):
     description = db.Column(db.Text)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
+    geohash = db.Column(db.String(12), index=True)
     severity = db.Column(db.String(20), default='medium')
     photo = db.Column(db.String(200))
     reporter_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     status = db.Column(db.String(20), default='reported')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Фільтр за статусом разом із діапазоном geohash читається з одного індексу
+    __table_args__ = (
+        db.Index('ix_polluted_place_status_geohash', 'status', 'geohash'),
+        db.Index('ix_polluted_place_updated_at', 'updated_at'),
+    )
+
+
+class PlatformStats(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    total_events = db.Column(db.Integer, default=0, nullable=False)
+    total_waste = db.Column(db.Float, default=0.0, nullable=False)
+    total_area = db.Column(db.Float, default=0.0, nullable=False)
+    total_users = db.Column(db.Integer, default=0, nullable=False)
+    active_teams = db.Column(db.Integer, default=0, nullable=False)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    reconciled_at = db.Column(db.DateTime)
+
+
+class StoredBlob(db.Model):
+    key = db.Column(db.String(100), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, default=1, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    released_at = db.Column(db.DateTime)
+
+
+class RankNode(db.Model):
+    # Вузли дерева Фенвіка над балами (leaderboard.py); board — назва таблиці рейтингу
+    board = db.Column(db.String(10), primary_key=True)
+    node = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+
+class ImpactRollup(db.Model):
+    # Підсумки завершених подій за період; scope_key — '' для all, id команди або префікс geohash
+    period = db.Column(db.String(5), primary_key=True)
+    scope = db.Column(db.String(5), primary_key=True)
+    scope_key = db.Column(db.String(20), primary_key=True)
+    period_start = db.Column(db.Date, primary_key=True)
+    events = db.Column(db.Integer, default=0, nullable=False)
+    participants = db.Column(db.Integer, default=0, nullable=False)
+    waste = db.Column(db.Float, default=0.0, nullable=False)
+    area = db.Column(db.Float, default=0.0, nullable=False)
+
+    __table_args__ = (db.Index('ix_impact_rollup_breakdown', 'period', 'scope', 'period_start'),)
+
+
+class Job(db.Model):
+    # Черга фонових завдань (jobs.py); unique_key не дає поставити те саме завдання двічі
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(10), default='queued', nullable=False)
+    unique_key = db.Column(db.String(200))
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = db.Column(db.String(100))
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+        db.Index('uq_job_unique_key', 'unique_key', unique=True),
+        db.Index('ix_job_locked_by', 'locked_by'),
+    )
+
+
+# geohash завжди відповідає координатам рядка
+@db.event.listens_for(Event, 'before_insert')
+@db.event.listens_for(Event, 'before_update')
+@db.event.listens_for(PollutedPlace, 'before_insert')
+@db.event.listens_for(PollutedPlace, 'before_update')
+def set_geohash(mapper, connection, target):
+    target.geohash = geo.encode(target.latitude, target.longitude)
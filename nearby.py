@@ -0,0 +1,117 @@
+from datetime import datetime
+import numpy as np
+from sqlalchemy import select
+from models import db, Event, PollutedPlace
+from spatial import in_bbox
+import geo
+
+# Пари місце × подія рахуються порціями, щоб матриця відстаней не перевищувала ~8 МБ
+MATCH_CHUNK_CELLS = 1_000_000
+
+
+def _layers():
+    return {
+        'places': (PollutedPlace, PollutedPlace.status == 'reported',
+                   (PollutedPlace.title, PollutedPlace.severity, PollutedPlace.created_at)),
+        'events': (Event, (Event.status == 'planned') & (Event.date >= datetime.utcnow()),
+                   (Event.title, Event.location, Event.date, Event.participants_count, Event.max_participants)),
+    }
+
+
+def haversine_m(lat, lon, lats, lons):
+    # Працює і для точки проти масиву, і для матриці через broadcasting (lat формою (n, 1))
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * geo.EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def candidates(model, condition, lat, lon, radius_m):
+    # Лише id і координати: усі кандидати з bbox потрапляють у масиви без створення обʼєктів
+    rows = db.session.execute(
+        select(model.id, model.latitude, model.longitude)
+        .where(in_bbox(model, geo.around(lat, lon, radius_m), condition))
+    ).all()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    points = np.array(rows, dtype=np.float64)
+    return points[:, 0].astype(np.int64), points[:, 1], points[:, 2]
+
+
+def rank(lat, lon, radius_m, ids, lats, lons, limit):
+    distances = haversine_m(lat, lon, lats, lons)
+    inside = np.flatnonzero(distances <= radius_m)
+    if len(inside) > limit:
+        # argpartition відбирає найближчі за O(n), сортується лише верхівка
+        inside = inside[np.argpartition(distances[inside], limit - 1)[:limit]]
+    order = inside[np.argsort(distances[inside], kind='stable')]
+    return ids[order], distances[order], lats[order], lons[order]
+
+
+def nearest(lats, lons, target_lats, target_lons):
+    # Для кожної точки — індекс найближчої цілі та відстань до неї
+    index = np.empty(len(lats), dtype=np.int64)
+    distance = np.empty(len(lats))
+    if not len(target_lats):
+        index.fill(-1)
+        distance.fill(np.inf)
+        return index, distance
+    step = max(1, MATCH_CHUNK_CELLS // len(target_lats))
+    for start in range(0, len(lats), step):
+        matrix = haversine_m(lats[start:start + step, None], lons[start:start + step, None], target_lats, target_lons)
+        index[start:start + step] = matrix.argmin(axis=1)
+        distance[start:start + step] = matrix[np.arange(len(matrix)), index[start:start + step]]
+    return index, distance
+
+
+def _details(model, columns, ids):
+    rows = db.session.execute(select(model.id, *columns).where(model.id.in_(ids.tolist()))).all()
+    return {row.id: row for row in rows}
+
+
+def _item(layer, row, lat, lon, distance):
+    item = {'layer': layer, 'id': row.id, 'title': row.title, 'latitude': round(float(lat), 6),
+            'longitude': round(float(lon), 6), 'distance_m': round(float(distance))}
+    if layer == 'places':
+        item['severity'] = row.severity
+        item['reported_at'] = row.created_at.isoformat() if row.created_at else None
+    else:
+        item['location'] = row.location
+        item['date'] = row.date.isoformat()
+        item['participants_count'] = row.participants_count
+        item['max_participants'] = row.max_participants
+    return item
+
+
+def search(lat, lon, radius_m, layers, limit=20, match_radius_m=None):
+    definitions = _layers()
+    result = {}
+    for layer in layers:
+        model, condition, columns = definitions[layer]
+        ids, distances, lats, lons = rank(lat, lon, radius_m, *candidates(model, condition, lat, lon, radius_m), limit)
+        details = _details(model, columns, ids) if len(ids) else {}
+        result[layer] = [_item(layer, details[i], la, lo, d)
+                         for i, d, la, lo in zip(ids.tolist(), distances, lats, lons) if i in details]
+
+        if layer == 'places' and match_radius_m and result[layer]:
+            match_events(result[layer], match_radius_m)
+    return result
+
+
+def match_events(places, match_radius_m):
+    # Додає кожному місцю найближчу заплановану подію не далі match_radius_m
+    model, condition, _ = _layers()['events']
+    lats = np.array([place['latitude'] for place in places])
+    lons = np.array([place['longitude'] for place in places])
+    center_lat, center_lon = float(lats.mean()), float(lons.mean())
+    reach = float(haversine_m(center_lat, center_lon, lats, lons).max()) + match_radius_m
+    event_ids, event_lats, event_lons = candidates(model, condition, center_lat, center_lon, reach)
+    index, distance = nearest(lats, lons, event_lats, event_lons)
+
+    matched_ids = sorted({int(event_ids[i]) for i, d in zip(index, distance) if i >= 0 and d <= match_radius_m})
+    titles = dict(db.session.execute(select(Event.id, Event.title).where(Event.id.in_(matched_ids))).all()) \
+        if matched_ids else {}
+    for place, i, d in zip(places, index, distance):
+        event_id = int(event_ids[i]) if i >= 0 else None
+        place['nearest_event'] = {'id': event_id, 'title': titles.get(event_id), 'distance_m': round(float(d))} \
+            if event_id in titles and d <= match_radius_m else None
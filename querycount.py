@@ -0,0 +1,70 @@
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit):
+    # Окремий бюджет для маршруту, який законно робить більше запитів
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def _budget_for(app):
+    view = app.view_functions.get(request.endpoint)
+    return getattr(view, 'query_budget', app.config['QUERY_BUDGET'])
+
+
+def init_app(app):
+    app.config.setdefault('QUERY_BUDGET', None)
+    app.config.setdefault('QUERY_BUDGET_ENFORCE', app.config.get('TESTING', False))
+    # Обробники реєструються завжди, а бюджет читається на кожному запиті:
+    # check-query-budget задає його вже після створення застосунку
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+
+    @app.before_request
+    def reset_query_count():
+        g.query_count = 0
+
+    @app.after_request
+    def check_query_budget(response):
+        if not app.config['QUERY_BUDGET']:
+            return response
+        count = g.get('query_count', 0)
+        response.headers['X-Query-Count'] = str(count)
+        budget = _budget_for(app)
+        if budget is not None and count > budget:
+            message = f'{request.method} {request.path}: {count} SQL queries, budget is {budget}'
+            if app.config['QUERY_BUDGET_ENFORCE']:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+        return response
+
+
+def crawl(app, paths, user_id=None):
+    # Проходить сторінки тестовим клієнтом і повертає перевищення бюджету
+    app.config['QUERY_BUDGET_ENFORCE'] = True
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+    client = app.test_client()
+    if user_id is not None:
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+
+    failures = []
+    for path in paths:
+        try:
+            client.get(path)
+        except QueryBudgetExceeded as e:
+            failures.append(str(e))
+    return failures
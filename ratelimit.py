@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import time
+from threading import Lock
+
+
+class MemoryBucketStore:
+    # Відра в памʼяті процесу: кожен воркер gunicorn має власний ліміт
+    def __init__(self):
+        self._buckets = {}
+        self._lock = Lock()
+
+    def take(self, key, requested, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            granted = min(requested, int(tokens))
+            self._buckets[key] = (tokens - granted, now)
+        return granted, _retry_after(tokens - granted, requested - granted, rate)
+
+
+class SQLiteBucketStore:
+    # Спільний локальний файл: усі воркери на одній машині ділять одні й ті самі відра
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def take(self, key, requested, capacity, rate):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            granted = min(requested, int(tokens))
+            conn.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens - granted, now))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return granted, _retry_after(tokens - granted, requested - granted, rate)
+
+
+def _retry_after(tokens, missing, rate):
+    if missing <= 0:
+        return 0
+    return max(1, int((missing - tokens) / rate + 0.999))
+
+
+_store = None
+
+
+def init_app(app):
+    global _store
+    app.config.setdefault('RATELIMIT_STORAGE', 'memory')
+    storage = app.config['RATELIMIT_STORAGE']
+    if storage.startswith('sqlite:///'):
+        _store = SQLiteBucketStore(storage[len('sqlite:///'):])
+    else:
+        _store = MemoryBucketStore()
+
+
+def take(scope, identity, requested, capacity, rate):
+    return _store.take(f'{scope}:{identity}', requested, capacity, rate)
@@ -0,0 +1,225 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import select, insert, update, delete, func, or_, exists
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models import db, User, Event, event_participants, event_waitlist
+
+JOINED = 'joined'
+ALREADY_JOINED = 'already_joined'
+WAITLISTED = 'waitlisted'
+ALREADY_WAITLISTED = 'already_waitlisted'
+CLOSED = 'closed'
+
+
+class _NoSeat(Exception):
+    pass
+
+
+def _claim_seat(event_id, user_id):
+    # PK (user_id, event_id) робить запис ідемпотентним, а умовний UPDATE не дає перевищити ліміт:
+    # на Postgres рядок події блокується, на SQLite запис і так серіалізований.
+    with db.session.begin_nested():
+        db.session.execute(insert(event_participants).values(event_id=event_id, user_id=user_id))
+        claimed = db.session.execute(
+            update(Event)
+            .where(Event.id == event_id, Event.status == 'planned',
+                   or_(Event.max_participants.is_(None), Event.participants_count < Event.max_participants))
+            .values(participants_count=Event.participants_count + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            raise _NoSeat()
+
+
+def join(event_id, user_id):
+    try:
+        _claim_seat(event_id, user_id)
+    except IntegrityError:
+        return ALREADY_JOINED
+    except _NoSeat:
+        is_open = db.session.execute(
+            select(exists().where(Event.id == event_id, Event.status == 'planned'))
+        ).scalar()
+        if not is_open:
+            return CLOSED
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(event_waitlist).values(event_id=event_id, user_id=user_id))
+        except IntegrityError:
+            return ALREADY_WAITLISTED
+        # Місце могло звільнитися між перевіркою і записом у чергу
+        if user_id in promote(event_id):
+            return JOINED
+        return WAITLISTED
+
+    db.session.execute(delete(event_waitlist).where(
+        event_waitlist.c.event_id == event_id, event_waitlist.c.user_id == user_id
+    ))
+    return JOINED
+
+
+def leave(event_id, user_id):
+    left = db.session.execute(delete(event_participants).where(
+        event_participants.c.event_id == event_id, event_participants.c.user_id == user_id
+    )).rowcount
+    if not left:
+        removed = db.session.execute(delete(event_waitlist).where(
+            event_waitlist.c.event_id == event_id, event_waitlist.c.user_id == user_id
+        )).rowcount
+        return bool(removed), []
+
+    db.session.execute(
+        update(Event)
+        .where(Event.id == event_id)
+        .values(participants_count=Event.participants_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+    return True, promote(event_id)
+
+
+def promote(event_id):
+    # Переводить людей з черги, поки є вільні місця
+    promoted = []
+    while True:
+        user_id = db.session.execute(
+            select(event_waitlist.c.user_id)
+            .where(event_waitlist.c.event_id == event_id)
+            .order_by(event_waitlist.c.created_at, event_waitlist.c.user_id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar()
+        if user_id is None:
+            break
+        try:
+            _claim_seat(event_id, user_id)
+        except _NoSeat:
+            break
+        except IntegrityError:
+            pass
+        else:
+            promoted.append(user_id)
+        db.session.execute(delete(event_waitlist).where(
+            event_waitlist.c.event_id == event_id, event_waitlist.c.user_id == user_id
+        ))
+    return promoted
+
+
+def is_participant(event_id, user_id):
+    return db.session.execute(select(exists().where(
+        event_participants.c.event_id == event_id, event_participants.c.user_id == user_id
+    ))).scalar()
+
+
+def waitlist_position(event_id, user_id):
+    joined_at = db.session.execute(
+        select(event_waitlist.c.created_at)
+        .where(event_waitlist.c.event_id == event_id, event_waitlist.c.user_id == user_id)
+    ).scalar()
+    if joined_at is None:
+        return None
+    ahead = db.session.execute(
+        select(func.count()).select_from(event_waitlist)
+        .where(event_waitlist.c.event_id == event_id, event_waitlist.c.created_at < joined_at)
+    ).scalar()
+    return ahead + 1
+
+
+def _with_retry(app, action, attempts=50):
+    # Кожен потік має власний контекст застосунку, а отже власну сесію
+    with app.app_context():
+        for _ in range(attempts):
+            try:
+                result = action()
+                db.session.commit()
+                return result
+            except OperationalError:
+                db.session.rollback()
+                time.sleep(random.uniform(0.01, 0.05))
+    raise RuntimeError('database stayed locked')
+
+
+def stress_test(database_url, users=200, capacity=20, threads=16, leave_ratio=0.2):
+    # Окремий застосунок на порожній базі: навантаження не торкається робочих даних
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    db.init_app(app)
+    tag = f'stress_{int(time.time())}'
+    with app.app_context():
+        db.create_all()
+    try:
+        with app.app_context():
+            creator = User(username=f'{tag}_creator', email=f'{tag}_creator@example.invalid', password_hash='-')
+            db.session.add(creator)
+            db.session.flush()
+            event = Event(title=tag, location=tag, date=datetime.utcnow() + timedelta(days=1),
+                          max_participants=capacity, creator_id=creator.id)
+            db.session.add(event)
+            db.session.execute(insert(User), [
+                {'username': f'{tag}_{i}', 'email': f'{tag}_{i}@example.invalid', 'password_hash': '-'}
+                for i in range(users)
+            ])
+            db.session.commit()
+            event_id = event.id
+            user_ids = db.session.execute(
+                select(User.id).where(User.username.like(f'{tag}\\_%', escape='\\'), User.id != creator.id)
+            ).scalars().all()
+
+        work = [(join, user_id) for user_id in user_ids for _ in range(2)]
+        work += [(leave, user_id) for user_id in random.sample(user_ids, int(users * leave_ratio))]
+        random.shuffle(work)
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if not work:
+                        return
+                    action, user_id = work.pop()
+                _with_retry(app, lambda: action(event_id, user_id))
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = [pool.submit(worker) for _ in range(threads)]
+        # Виняток у потоці означає втрачену роботу: інваріанти після неї нічого не доводять
+        for future in futures:
+            future.result()
+
+        with app.app_context():
+            stored_count = db.session.get(Event, event_id).participants_count
+            actual = db.session.execute(
+                select(func.count()).select_from(event_participants).where(event_participants.c.event_id == event_id)
+            ).scalar()
+            waiting = db.session.execute(
+                select(func.count()).select_from(event_waitlist).where(event_waitlist.c.event_id == event_id)
+            ).scalar()
+            both = db.session.execute(
+                select(func.count()).select_from(event_participants).join(
+                    event_waitlist,
+                    (event_waitlist.c.user_id == event_participants.c.user_id) &
+                    (event_waitlist.c.event_id == event_participants.c.event_id)
+                ).where(event_participants.c.event_id == event_id)
+            ).scalar()
+
+        problems = []
+        if actual > capacity:
+            problems.append(f'overbooked: {actual} > {capacity}')
+        if stored_count != actual:
+            problems.append(f'participants_count {stored_count} != {actual} rows')
+        if waiting and actual < capacity:
+            problems.append(f'{waiting} waiting while only {actual}/{capacity} seats are taken')
+        if both:
+            problems.append(f'{both} users are both registered and waitlisted')
+        return {'participants': actual, 'waitlist': waiting, 'capacity': capacity}, problems
+    finally:
+        with app.app_context():
+            db.session.rollback()
+            event_ids = select(Event.id).where(Event.title == tag).scalar_subquery()
+            db.session.execute(delete(event_participants).where(event_participants.c.event_id.in_(event_ids)))
+            db.session.execute(delete(event_waitlist).where(event_waitlist.c.event_id.in_(event_ids)))
+            db.session.execute(delete(Event).where(Event.title == tag))
+            db.session.execute(delete(User).where(User.username.like(f'{tag}\\_%', escape='\\')))
+            db.session.commit()
+            db.engine.dispose()
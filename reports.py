@@ -0,0 +1,136 @@
+import json
+import math
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, insert, and_, or_
+from models import db, PollutedPlace
+import geo
+
+SEVERITIES = ('low', 'medium', 'high', 'critical')
+
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def validate(item, now=None):
+    now = now or datetime.utcnow()
+    if not isinstance(item, dict):
+        return None, ['Очікується JSON-обʼєкт']
+
+    errors = []
+    title = item.get('title')
+    if not isinstance(title, str) or not title.strip():
+        errors.append('title: обовʼязкове поле')
+    elif len(title) > 200:
+        errors.append('title: не більше 200 символів')
+
+    description = item.get('description')
+    if description is not None and not isinstance(description, str):
+        errors.append('description: має бути рядком')
+
+    latitude = _number(item.get('latitude'))
+    longitude = _number(item.get('longitude'))
+    if latitude is None or not -90 <= latitude <= 90:
+        errors.append('latitude: число від -90 до 90')
+    if longitude is None or not -180 <= longitude <= 180:
+        errors.append('longitude: число від -180 до 180')
+
+    severity = item.get('severity') or 'medium'
+    if severity not in SEVERITIES:
+        errors.append(f'severity: одне з {", ".join(SEVERITIES)}')
+
+    # Мобільний застосунок надсилає час створення звіту офлайн
+    created_at = now
+    if item.get('reported_at'):
+        try:
+            created_at = datetime.fromisoformat(str(item['reported_at']).replace('Z', '+00:00'))
+            if created_at.tzinfo is not None:
+                created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+        except ValueError:
+            errors.append('reported_at: дата у форматі ISO 8601')
+        else:
+            if created_at > now + timedelta(minutes=5):
+                errors.append('reported_at: дата в майбутньому')
+
+    if errors:
+        return None, errors
+    return {
+        'title': title.strip(),
+        'description': description,
+        'latitude': latitude,
+        'longitude': longitude,
+        'geohash': geo.encode(latitude, longitude),
+        'severity': severity,
+        'created_at': created_at,
+    }, []
+
+
+def parse_ndjson(stream, limit):
+    # Читає потік рядок за рядком, не завантажуючи все тіло в памʼять
+    for index, line in enumerate(stream):
+        if index >= limit:
+            yield None, 'too_many'
+            return
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError:
+            yield None, 'invalid_json'
+
+
+def _candidates(rows, radius_m, window):
+    cells = set()
+    for row in rows:
+        cells.update(geo.cover(geo.around(row['latitude'], row['longitude'], radius_m), precision=6))
+    since = min(row['created_at'] for row in rows) - window
+    return db.session.execute(
+        select(PollutedPlace.id, PollutedPlace.latitude, PollutedPlace.longitude, PollutedPlace.created_at)
+        .where(
+            or_(*[and_(PollutedPlace.geohash >= cell, PollutedPlace.geohash < cell + '~') for cell in sorted(cells)]),
+            PollutedPlace.created_at >= since,
+        )
+    ).all()
+
+
+def _find_duplicate(row, known, radius_m, window):
+    for place_id, latitude, longitude, created_at in known:
+        if abs(created_at - row['created_at']) <= window and \
+                geo.distance_m(row['latitude'], row['longitude'], latitude, longitude) <= radius_m:
+            return place_id
+    return None
+
+
+def ingest_chunk(rows, reporter_id, radius_m=50, window=timedelta(hours=24)):
+    # rows: список перевірених звітів; повертає (id або None, id дубліката або None) для кожного
+    if not rows:
+        return []
+    known = [tuple(candidate) for candidate in _candidates(rows, radius_m, window)]
+    outcome = []
+    fresh = []
+    for row in rows:
+        duplicate_of = _find_duplicate(row, known, radius_m, window)
+        if duplicate_of is not None:
+            outcome.append((None, duplicate_of))
+            continue
+        # Тимчасовий відʼємний id, щоб дублікати всередині пакета посилались на перший звіт
+        placeholder = -(len(fresh) + 1)
+        known.append((placeholder, row['latitude'], row['longitude'], row['created_at']))
+        fresh.append(dict(row, reporter_id=reporter_id, status='reported'))
+        outcome.append((placeholder, None))
+
+    ids = []
+    if fresh:
+        ids = db.session.execute(
+            insert(PollutedPlace).returning(PollutedPlace.id, sort_by_parameter_order=True), fresh
+        ).scalars().all()
+
+    def real(place_id):
+        return ids[-place_id - 1] if place_id is not None and place_id < 0 else place_id
+
+    return [(real(created), real(duplicate_of)) for created, duplicate_of in outcome]
@@ -0,0 +1,55 @@
+from sqlalchemy import select, update, func
+from models import db, User, Event, Team, event_participants
+from leaderboard import shift_points
+
+
+def points_for(waste, area):
+    return int(waste * 10 + area * 2)
+
+
+def settle_event(event_id, waste, area):
+    # Умовний перехід статусу: повторний запит не змінить жодного рядка,
+    # тому бали за одну подію нараховуються рівно один раз.
+    result = db.session.execute(
+        update(Event)
+        .where(Event.id == event_id, Event.status != 'completed')
+        .values(status='completed', waste_collected=waste, area_cleaned=area)
+    )
+    if result.rowcount != 1:
+        return None
+
+    participant_ids = select(event_participants.c.user_id).where(event_participants.c.event_id == event_id)
+    participant_count = db.session.execute(
+        select(func.count()).select_from(event_participants).where(event_participants.c.event_id == event_id)
+    ).scalar()
+
+    points_per_person = points_for(waste, area)
+    if participant_count > 0:
+        new_points = db.session.execute(
+            update(User)
+            .where(User.id.in_(participant_ids))
+            .values(
+                points=User.points + points_per_person,
+                events_count=User.events_count + 1,
+                total_waste=User.total_waste + waste / participant_count,
+                total_area=User.total_area + area / participant_count,
+            )
+            .returning(User.points)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        # Бали після UPDATE під блокуванням рядків: паралельні нарахування не дають розбіжностей у дереві
+        shift_points('user', new_points, points_per_person)
+
+    team_id = db.session.execute(select(Event.team_id).where(Event.id == event_id)).scalar()
+    if team_id is not None:
+        team_points = db.session.execute(
+            update(Team)
+            .where(Team.id == team_id)
+            .values(points=Team.points + points_per_person * participant_count,
+                    events_count=Team.events_count + 1)
+            .returning(Team.points)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        shift_points('team', team_points, points_per_person * participant_count)
+
+    return participant_count
@@ -0,0 +1,140 @@
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import select, delete
+from models import db, Event, ImpactRollup
+
+PERIODS = ('day', 'week', 'month')
+SCOPES = ('all', 'team', 'cell')
+# Комірка geohash з 4 символів — приблизно 39 × 20 км
+CELL_PRECISION = 4
+MEASURES = ('events', 'participants', 'waste', 'area')
+
+
+def period_start(period, day):
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_start(period, start):
+    if period == 'week':
+        return start + timedelta(days=7)
+    if period == 'month':
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def _scopes(team_id, geohash):
+    yield 'all', ''
+    if team_id is not None:
+        yield 'team', str(team_id)
+    if geohash:
+        yield 'cell', geohash[:CELL_PRECISION]
+
+
+def _rows(day, team_id, geohash, measures):
+    for period in PERIODS:
+        for scope, key in _scopes(team_id, geohash):
+            yield (period, scope, key, period_start(period, day)), measures
+
+
+def _upsert(rows, execute, chunk=1000):
+    # INSERT ... ON CONFLICT DO UPDATE додає приріст до наявних рядків (SQLite і Postgres);
+    # пачки по chunk рядків тримають кількість параметрів у межах лімітів обох баз
+    if not rows:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    table = ImpactRollup.__table__
+    rows = sorted(rows, key=lambda row: row[0])
+    for start in range(0, len(rows), chunk):
+        statement = insert(table).values([
+            dict(zip(('period', 'scope', 'scope_key', 'period_start'), key), **dict(zip(MEASURES, values)))
+            for key, values in rows[start:start + chunk]
+        ])
+        execute(statement.on_conflict_do_update(
+            index_elements=['period', 'scope', 'scope_key', 'period_start'],
+            set_={name: table.c[name] + statement.excluded[name] for name in MEASURES},
+        ))
+
+
+def record(event_id, waste, area, participants):
+    # Викликається в тій самій транзакції, що й settle_event
+    event = db.session.execute(select(Event.date, Event.team_id, Event.geohash).where(Event.id == event_id)).one()
+    rows = list(_rows(event.date.date(), event.team_id, event.geohash, (1, participants, waste, area)))
+    _upsert(rows, db.session.execute)
+
+
+def rebuild(conn, chunk=5000, echo=None):
+    # Повний перерахунок з історії: пачками за id, агрегація кожної пачки в памʼяті
+    conn.execute(delete(ImpactRollup))
+    last_id = 0
+    processed = 0
+    while True:
+        events = conn.execute(
+            select(Event.id, Event.date, Event.team_id, Event.geohash, Event.participants_count,
+                   Event.waste_collected, Event.area_cleaned)
+            .where(Event.status == 'completed', Event.id > last_id)
+            .order_by(Event.id)
+            .limit(chunk)
+        ).all()
+        if not events:
+            return processed
+        totals = defaultdict(lambda: [0, 0, 0.0, 0.0])
+        for event in events:
+            measures = (1, event.participants_count or 0, event.waste_collected or 0.0, event.area_cleaned or 0.0)
+            for key, values in _rows(event.date.date(), event.team_id, event.geohash, measures):
+                bucket = totals[key]
+                for i, value in enumerate(values):
+                    bucket[i] += value
+        _upsert(list(totals.items()), conn.execute)
+        last_id = events[-1].id
+        processed += len(events)
+        if echo:
+            echo(f'{processed} подій')
+
+
+def series(period, scope, key, start, end):
+    # Читає лише рядки потрібного вікна з первинного ключа; порожні періоди заповнюються нулями
+    rows = db.session.execute(
+        select(ImpactRollup.period_start, ImpactRollup.events, ImpactRollup.participants,
+               ImpactRollup.waste, ImpactRollup.area)
+        .where(ImpactRollup.period == period, ImpactRollup.scope == scope, ImpactRollup.scope_key == key,
+               ImpactRollup.period_start >= period_start(period, start), ImpactRollup.period_start < end)
+        .order_by(ImpactRollup.period_start)
+    ).all()
+    found = {row.period_start: row for row in rows}
+    points = []
+    cursor = period_start(period, start)
+    while cursor < end:
+        row = found.get(cursor)
+        points.append({
+            'start': cursor.isoformat(),
+            'events': row.events if row else 0,
+            'participants': row.participants if row else 0,
+            'waste': round(row.waste, 2) if row else 0.0,
+            'area': round(row.area, 2) if row else 0.0,
+        })
+        cursor = next_start(period, cursor)
+    return points
+
+
+def breakdown(period, scope, day, limit=10, order='waste'):
+    rows = db.session.execute(
+        select(ImpactRollup.scope_key, *[ImpactRollup.__table__.c[name] for name in MEASURES])
+        .where(ImpactRollup.period == period, ImpactRollup.scope == scope,
+               ImpactRollup.period_start == period_start(period, day))
+        .order_by(ImpactRollup.__table__.c[order].desc(), ImpactRollup.scope_key)
+        .limit(limit)
+    ).all()
+    return [{'key': row.scope_key, 'events': row.events, 'participants': row.participants,
+             'waste': round(row.waste, 2), 'area': round(row.area, 2)} for row in rows]
+
+
+def bucket_count(period, start, end):
+    days = (end - start).days
+    return {'day': days, 'week': days // 7 + 1, 'month': days // 28 + 1}[period]
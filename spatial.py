@@ -0,0 +1,75 @@
+from sqlalchemy import select, func, and_, or_
+from models import db, Event, PollutedPlace
+import geo
+
+LAYERS = {
+    'places': (PollutedPlace, lambda: PollutedPlace.status == 'reported'),
+    'events': (Event, lambda: Event.status == 'planned'),
+}
+
+
+def in_bbox(model, bbox, condition=None):
+    # Префікси geohash звужують пошук до діапазонів індексу, координати відсікають краї комірок.
+    # condition повторюється в кожній гілці OR, щоб кожен діапазон читався з індексу (status, geohash)
+    west, south, east, north = bbox
+    prefix = (condition,) if condition is not None else ()
+    return and_(
+        or_(*[and_(*prefix, model.geohash >= cell, model.geohash < cell + '~') for cell in geo.cover(bbox)]),
+        model.latitude.between(south, north),
+        model.longitude.between(west, east),
+    )
+
+
+def _feature(lat, lon, properties):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [round(lon, 5), round(lat, 5)]},
+        'properties': properties,
+    }
+
+
+def _clusters(layer, bbox, precision):
+    model, condition = LAYERS[layer]
+    cell = func.substr(model.geohash, 1, precision)
+    rows = db.session.execute(
+        select(cell, func.count(), func.avg(model.latitude), func.avg(model.longitude), func.min(model.id))
+        .where(in_bbox(model, bbox, condition()))
+        .group_by(cell)
+    ).all()
+    return [_feature(lat, lon, {'layer': layer, 'cell': cell_id, 'count': count, 'id': first_id})
+            for cell_id, count, lat, lon, first_id in rows]
+
+
+def _points(layer, bbox, limit):
+    model, condition = LAYERS[layer]
+    if layer == 'places':
+        columns = (PollutedPlace.id, PollutedPlace.latitude, PollutedPlace.longitude,
+                   PollutedPlace.title, PollutedPlace.severity)
+    else:
+        columns = (Event.id, Event.latitude, Event.longitude, Event.title, Event.date)
+    rows = db.session.execute(
+        select(*columns).where(in_bbox(model, bbox, condition())).order_by(model.id).limit(limit)
+    ).all()
+
+    features = []
+    for row in rows:
+        properties = {'layer': layer, 'id': row.id, 'title': row.title}
+        if layer == 'places':
+            properties['severity'] = row.severity
+        else:
+            properties['date'] = row.date.isoformat()
+        features.append(_feature(row.latitude, row.longitude, properties))
+    return features
+
+
+def feature_collection(bbox, zoom, layers, cluster_max_zoom=14, limit=2000):
+    features = []
+    truncated = False
+    for layer in layers:
+        if zoom <= cluster_max_zoom:
+            features += _clusters(layer, bbox, geo.cluster_precision(zoom))
+        else:
+            points = _points(layer, bbox, limit + 1)
+            truncated = truncated or len(points) > limit
+            features += points[:limit]
+    return {'type': 'FeatureCollection', 'features': features, 'truncated': truncated}
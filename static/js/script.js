@@ -28,6 +28,34 @@ function updateStats() {
         .catch(error => console.error('Помилка:', error));
 }
 
+// Живі лічильники через Server-Sent Events (live.py); без data-live сторінка працює як раніше
+document.querySelectorAll('[data-live]').forEach(root => {
+    if (!('EventSource' in window)) return;
+    const source = new EventSource(root.dataset.live);
+
+    source.addEventListener('stats', e => {
+        const data = JSON.parse(e.data);
+        root.querySelectorAll('[data-stat]').forEach(el => {
+            const value = data[el.dataset.stat];
+            if (value === undefined) return;
+            el.textContent = Number(value).toFixed(Number(el.dataset.digits || 0)) + (el.dataset.unit || '');
+        });
+    });
+
+    source.addEventListener('event', e => {
+        const data = JSON.parse(e.data);
+        // Завершення чи скасування змінює всю сторінку (результати, кнопки), тож її простіше перезавантажити
+        if (root.dataset.status && data.status !== root.dataset.status) {
+            source.close();
+            window.location.reload();
+            return;
+        }
+        root.querySelectorAll('[data-participants]').forEach(el => {
+            el.textContent = data.participants_count + (data.max_participants ? '/' + data.max_participants : '');
+        });
+    });
+});
+
 // Валідація форм
 const forms = document.querySelectorAll('form');
 forms.forEach(form => {
@@ -0,0 +1,68 @@
+from datetime import datetime
+from sqlalchemy import select, update, func
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Event, Team, PlatformStats
+
+STATS_ID = 1
+COUNTERS = ('total_events', 'total_waste', 'total_area', 'total_users', 'active_teams')
+
+
+def compute_stats():
+    completed = select(
+        func.count(Event.id),
+        func.coalesce(func.sum(Event.waste_collected), 0),
+        func.coalesce(func.sum(Event.area_cleaned), 0),
+    ).where(Event.status == 'completed')
+    total_events, total_waste, total_area = db.session.execute(completed).one()
+    return {
+        'total_events': total_events,
+        'total_waste': float(total_waste),
+        'total_area': float(total_area),
+        'total_users': db.session.execute(select(func.count(User.id))).scalar(),
+        'active_teams': db.session.execute(select(func.count(Team.id))).scalar(),
+    }
+
+
+def reconcile_stats():
+    values = compute_stats()
+    row = db.session.get(PlatformStats, STATS_ID)
+    if row is None:
+        row = PlatformStats(id=STATS_ID, version=0)
+        db.session.add(row)
+    for name, value in values.items():
+        setattr(row, name, value)
+    row.version = (row.version or 0) + 1
+    row.reconciled_at = datetime.utcnow()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Інший воркер створив рядок одночасно з нами
+        db.session.rollback()
+        return reconcile_stats()
+    return row
+
+
+def get_stats():
+    row = db.session.get(PlatformStats, STATS_ID)
+    if row is None:
+        row = reconcile_stats()
+    return row
+
+
+def bump_stats(**deltas):
+    # Виконується в транзакції запиту, тому лічильники змінюються разом з даними
+    values = {name: getattr(PlatformStats, name) + delta for name, delta in deltas.items()}
+    db.session.execute(
+        update(PlatformStats)
+        .where(PlatformStats.id == STATS_ID)
+        .values(version=PlatformStats.version + 1, **values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def stats_dict(row):
+    return {name: getattr(row, name) for name in COUNTERS}
+
+
+def stats_etag(row):
+    return f'stats-{row.version}'
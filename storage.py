@@ -0,0 +1,294 @@
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from flask import url_for
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
+from models import db, StoredBlob
+import metrics
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# aa/bb/<sha256>.ext — оригінал, aa/bb/<sha256>_<варіант>.ext — похідний файл
+BLOB_NAME = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(_[a-z]+)?\.[a-z0-9]+$')
+
+_backend = None
+
+
+def content_type(key):
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+class StorageBackend:
+    # Сховище незмінних обʼєктів: ключ визначається вмістом і ніколи не перезаписується
+
+    def staging_dir(self):
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def put_file(self, key, path):
+        raise NotImplementedError
+
+    def fetch(self, key, path):
+        raise NotImplementedError
+
+    def open(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def list_keys(self):
+        # (ключ, час зміни в UTC) у лексикографічному порядку, тож файли одного каталогу йдуть поспіль
+        raise NotImplementedError
+
+    def purge_staging(self, before):
+        return 0
+
+    def local_path(self, key):
+        return None
+
+    def url(self, key):
+        return url_for('media', key=key)
+
+
+class LocalBackend(StorageBackend):
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.staging_dir(), exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def staging_dir(self):
+        return os.path.join(self.root, '.staging')
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put_file(self, key, path):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    def fetch(self, key, path):
+        shutil.copyfile(self._path(key), path)
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list_keys(self):
+        for directory, dirs, files in os.walk(self.root):
+            dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                try:
+                    modified = os.path.getmtime(path)
+                except OSError:
+                    continue
+                yield os.path.relpath(path, self.root).replace(os.sep, '/'), datetime.utcfromtimestamp(modified)
+
+    def purge_staging(self, before):
+        # Тимчасові файли запитів, що впали посеред завантаження
+        removed = 0
+        for entry in os.scandir(self.staging_dir()):
+            try:
+                if entry.is_file() and datetime.utcfromtimestamp(entry.stat().st_mtime) < before:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def local_path(self, key):
+        return self._path(key)
+
+
+class S3Backend(StorageBackend):
+    # Працює з будь-яким S3-сумісним сервісом; для локальної перевірки вистачає MinIO через S3_ENDPOINT_URL
+    def __init__(self, bucket, endpoint_url=None, public_url=None, prefix=''):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError('Для STORAGE_BACKEND=s3 потрібен пакет boto3')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.prefix = prefix
+
+    def staging_dir(self):
+        return tempfile.gettempdir()
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self.client.exceptions.ClientError:
+            return False
+        return True
+
+    def put_file(self, key, path):
+        self.client.upload_file(path, self.bucket, self.prefix + key, ExtraArgs={
+            'ContentType': content_type(key),
+            'CacheControl': f'public, max-age={IMMUTABLE_MAX_AGE}, immutable',
+        })
+        os.remove(path)
+
+    def fetch(self, key, path):
+        self.client.download_file(self.bucket, self.prefix + key, path)
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def list_keys(self):
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', ()):
+                modified = item['LastModified'].astimezone(timezone.utc).replace(tzinfo=None)
+                yield item['Key'][len(self.prefix):], modified
+
+    def url(self, key):
+        if self.public_url:
+            return f'{self.public_url}/{self.prefix}{key}'
+        return super().url(key)
+
+
+def init_app(app):
+    global _backend
+    app.config.setdefault('STORAGE_BACKEND', 'local')
+    if app.config['STORAGE_BACKEND'] == 's3':
+        _backend = S3Backend(app.config['S3_BUCKET'], endpoint_url=app.config.get('S3_ENDPOINT_URL'),
+                             public_url=app.config.get('S3_PUBLIC_URL'), prefix=app.config.get('S3_PREFIX', ''))
+    else:
+        _backend = LocalBackend(app.config['UPLOAD_FOLDER'])
+    app.jinja_env.globals['media_url'] = media_url
+
+
+def backend():
+    return _backend
+
+
+def blob_key(digest, ext):
+    # Шардування за першими байтами хешу, щоб у каталозі не було мільйонів файлів
+    return f'{digest[:2]}/{digest[2:4]}/{digest}.{ext}'
+
+
+def store(stream, ext):
+    # Хеш рахується під час запису у тимчасовий файл, без буферизації всього файлу в памʼяті
+    with metrics.timer('toloka_upload_seconds', backend=type(_backend).__name__):
+        return _store(stream, ext)
+
+
+def _store(stream, ext):
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=_backend.staging_dir())
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                temp.write(chunk)
+                size += len(chunk)
+
+        key = blob_key(digest.hexdigest(), ext.lower())
+        if _acquire(key):
+            return key
+        # Без рядка StoredBlob наявний файл — сирота, якого може прибрати збирач сміття;
+        # повторний запис оновлює час зміни, і пільговий період захищає файл до коміту запиту
+        _backend.put_file(key, temp_path)
+        try:
+            with db.session.begin_nested():
+                db.session.add(StoredBlob(key=key, size=size, refcount=1))
+        except IntegrityError:
+            # Такий самий файл щойно зберіг інший запит
+            _acquire(key)
+        return key
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _acquire(key):
+    result = db.session.execute(
+        update(StoredBlob)
+        .where(StoredBlob.key == key)
+        .values(refcount=StoredBlob.refcount + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def release(key):
+    if key and '/' in key:
+        db.session.execute(
+            update(StoredBlob)
+            .where(StoredBlob.key == key)
+            .values(refcount=StoredBlob.refcount - 1, released_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+
+
+def collect_garbage(derived_keys, grace=timedelta(hours=1)):
+    # Видаляє обʼєкти без посилань разом з похідними (наприклад, варіантами зображень)
+    cutoff = datetime.utcnow() - grace
+    keys = db.session.execute(
+        select(StoredBlob.key).where(StoredBlob.refcount <= 0, StoredBlob.released_at < cutoff)
+    ).scalars().all()
+    removed = 0
+    for key in keys:
+        result = db.session.execute(delete(StoredBlob).where(StoredBlob.key == key, StoredBlob.refcount <= 0))
+        db.session.commit()
+        if result.rowcount:
+            for stored_key in [key, *derived_keys(key)]:
+                _backend.delete(stored_key)
+            removed += 1
+    return removed + _collect_orphans(derived_keys, cutoff)
+
+
+def _collect_orphans(derived_keys, cutoff):
+    # Файли без рядка StoredBlob: запит зберіг файл, але його транзакцію відкочено
+    removed = _backend.purge_staging(cutoff)
+    for _, entries in groupby(_backend.list_keys(), key=lambda entry: entry[0].rsplit('/', 1)[0]):
+        files = {key: modified for key, modified in entries if BLOB_NAME.match(key)}
+        sources = [key for key in files if '_' not in key]
+        known = set(db.session.execute(select(StoredBlob.key).where(StoredBlob.key.in_(sources))).scalars()) \
+            if sources else set()
+        db.session.rollback()
+        stems = {key.rsplit('.', 1)[0] for key in sources}
+        for key in sources:
+            if key not in known and files[key] < cutoff:
+                for stored_key in [key, *derived_keys(key)]:
+                    _backend.delete(stored_key)
+                removed += 1
+        for key, modified in files.items():
+            # Похідні файли, оригінал яких уже видалено
+            if '_' in key and key.rsplit('_', 1)[0] not in stems and modified < cutoff:
+                _backend.delete(key)
+                removed += 1
+    return removed
+
+
+def media_url(key):
+    if not key:
+        return None
+    if '/' not in key:
+        # Файли, завантажені до переходу на адресацію за вмістом
+        return url_for('static', filename='uploads/' + key)
+    return _backend.url(key)
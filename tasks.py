@@ -0,0 +1,162 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import select, or_
+from models import db, User, Event, Achievement, UserAchievement, event_participants
+from achievements import grant_for_event
+from stats import reconcile_stats
+import jobs
+import mailer
+
+_app = None
+
+
+def init_app(app):
+    global _app
+    _app = app
+    app.config.setdefault('REMINDER_LEAD', timedelta(hours=24))
+    app.config.setdefault('NOTIFY_BATCH', 100)
+    app.config.setdefault('DIGEST_DAYS', 7)
+    app.config.setdefault('BASE_URL', 'http://localhost:5000')
+
+
+def _event_url(event_id):
+    return f'{_app.config["BASE_URL"].rstrip("/")}/events/{event_id}'
+
+
+def fan_out(template, user_ids, **context):
+    # Один лист на завдання send_emails не масштабується; пачки по NOTIFY_BATCH адресатів
+    batch = _app.config['NOTIFY_BATCH']
+    jobs.enqueue_many('send_emails', [
+        dict(context, template=template, user_ids=user_ids[i:i + batch])
+        for i in range(0, len(user_ids), batch)
+    ])
+    return len(user_ids)
+
+
+@jobs.handler('grant_achievements')
+def grant_achievements(payload):
+    grant_for_event(payload['event_id'])
+
+
+@jobs.periodic('schedule_reminders', every=300)
+def schedule_reminders(payload):
+    now = datetime.utcnow()
+    event_ids = db.session.execute(
+        select(Event.id)
+        .where(Event.status == 'planned', Event.date > now, Event.date <= now + _app.config['REMINDER_LEAD'])
+    ).scalars().all()
+    # unique_key гарантує одне нагадування на подію, хоч би скільки разів її побачило сканування
+    jobs.enqueue_many('remind_event', [{'event_id': event_id} for event_id in event_ids],
+                      unique_keys=[f'remind_event:{event_id}' for event_id in event_ids])
+
+
+@jobs.handler('remind_event')
+def remind_event(payload):
+    status = db.session.execute(select(Event.status).where(Event.id == payload['event_id'])).scalar()
+    if status != 'planned':
+        return
+    user_ids = db.session.execute(
+        select(event_participants.c.user_id)
+        .where(event_participants.c.event_id == payload['event_id'])
+        .order_by(event_participants.c.user_id)
+    ).scalars().all()
+    fan_out('reminder', user_ids, event_id=payload['event_id'])
+
+
+@jobs.periodic('schedule_digests', every=24 * 3600)
+def schedule_digests(payload):
+    now = datetime.utcnow()
+    until = now + timedelta(days=_app.config['DIGEST_DAYS'])
+    since = now - timedelta(days=1)
+    upcoming = select(event_participants.c.user_id) \
+        .join(Event, Event.id == event_participants.c.event_id) \
+        .where(Event.status == 'planned', Event.date > now, Event.date <= until)
+    earned = select(UserAchievement.user_id).where(UserAchievement.earned_at >= since)
+    user_ids = db.session.execute(
+        select(User.id).where(or_(User.id.in_(upcoming), User.id.in_(earned))).order_by(User.id)
+    ).scalars().all()
+    # Межі вікна фіксуються в payload, тож повтор пачки надішле той самий дайджест
+    fan_out('digest', user_ids, now=now.isoformat(), until=until.isoformat(), since=since.isoformat())
+
+
+@jobs.periodic('reconcile_stats', every=900)
+def reconcile_stats_job(payload):
+    reconcile_stats()
+
+
+@jobs.periodic('purge_jobs', every=24 * 3600)
+def purge_jobs(payload):
+    jobs.purge(datetime.utcnow() - _app.config['JOB_RETENTION'])
+
+
+def _recipients(user_ids):
+    return db.session.execute(
+        select(User.id, User.email, User.username, User.full_name).where(User.id.in_(user_ids)).order_by(User.id)
+    ).all()
+
+
+def _reminder_messages(payload):
+    event = db.session.execute(
+        select(Event.id, Event.title, Event.date, Event.location, Event.status).where(Event.id == payload['event_id'])
+    ).first()
+    if event is None or event.status != 'planned':
+        return []
+    subject = f'Нагадування: {event.title}'
+    return [(user.id, mailer.message(user.email, subject, (
+        f'Привіт, {user.full_name or user.username}!\n\n'
+        f'Нагадуємо про толоку «{event.title}», на яку ви записались.\n'
+        f'Коли: {event.date:%d.%m.%Y %H:%M}\n'
+        f'Де: {event.location}\n\n'
+        f'{_event_url(event.id)}\n'
+    ))) for user in _recipients(payload['user_ids'])]
+
+
+def _digest_messages(payload):
+    now, until, since = (datetime.fromisoformat(payload[name]) for name in ('now', 'until', 'since'))
+    user_ids = payload['user_ids']
+    # Два запити на всю пачку замість двох на кожного адресата
+    events = defaultdict(list)
+    for row in db.session.execute(
+        select(event_participants.c.user_id, Event.id, Event.title, Event.date, Event.location)
+        .join(Event, Event.id == event_participants.c.event_id)
+        .where(event_participants.c.user_id.in_(user_ids), Event.status == 'planned',
+               Event.date > now, Event.date <= until)
+        .order_by(Event.date)
+    ):
+        events[row.user_id].append(row)
+    earned = defaultdict(list)
+    for row in db.session.execute(
+        select(UserAchievement.user_id, Achievement.name, Achievement.icon)
+        .join(Achievement, Achievement.id == UserAchievement.achievement_id)
+        .where(UserAchievement.user_id.in_(user_ids), UserAchievement.earned_at >= since)
+    ):
+        earned[row.user_id].append(row)
+
+    messages = []
+    for user in _recipients(user_ids):
+        if not events[user.id] and not earned[user.id]:
+            continue
+        lines = [f'Привіт, {user.full_name or user.username}!', '']
+        if events[user.id]:
+            lines.append(f'Ваші толоки на найближчі {_app.config["DIGEST_DAYS"]} днів:')
+            lines += [f'  • {e.date:%d.%m %H:%M} — {e.title} ({e.location}) {_event_url(e.id)}'
+                      for e in events[user.id]]
+            lines.append('')
+        if earned[user.id]:
+            lines.append('Нові досягнення:')
+            lines += [f'  {a.icon or "•"} {a.name}' for a in earned[user.id]]
+        messages.append((user.id, mailer.message(user.email, 'Толока: ваш дайджест', '\n'.join(lines) + '\n')))
+    return messages
+
+
+TEMPLATES = {
+    'reminder': _reminder_messages,
+    'digest': _digest_messages,
+}
+
+
+@jobs.handler('send_emails', max_attempts=8)
+def send_emails(payload):
+    messages = TEMPLATES[payload['template']](payload)
+    # Надіслані адресати вилучаються з payload: після збою повтор продовжить з решти пачки
+    mailer.send(messages, on_sent=payload['user_ids'].remove)